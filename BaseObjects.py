@@ -30,4 +30,244 @@ class Individual(object):
     def __repr__(self):
         return "<< INDIVIDUAL_ID:"+str(self.id)+", STATE:"+str(self.state)+", "+"PROPERTIES:"+str(self.properties)+">>"
     def __str__(self):
-        return "<< INDIVIDUAL_ID:"+str(self.id)+", STATE:"+str(self.state)+", "+"PROPERTIES:"+str(self.properties)+"\n"+"FRIENDS:"+str(self.friends)+">>\n"
\ No newline at end of file
+        return "<< INDIVIDUAL_ID:"+str(self.id)+", STATE:"+str(self.state)+", "+"PROPERTIES:"+str(self.properties)+"\n"+"FRIENDS:"+str(self.friends)+">>\n"
+
+class IndividualView(Individual):
+    def __init__(self, model, id):
+        """
+            A view of an individual that lives inside a model's ContactGraph.
+            Reading or setting state and time_since_infected goes straight
+            to the model's arrays. friends is rebuilt on every access, so
+            editing the returned list does not change the network.
+            @params:
+                model: the Model that owns the arrays
+                id: the ID of this individual
+        """
+        self.model = model
+        self.id = id
+    @property
+    def state(self):
+        return int(self.model.state[self.id])
+    @state.setter
+    def state(self, value):
+        self.model._transition(np.array([self.id]), self.model.state[self.id], value)
+    @property
+    def time_since_infected(self):
+        return int(self.model.time_since_infected[self.id])
+    @time_since_infected.setter
+    def time_since_infected(self, value):
+        self.model.time_since_infected[self.id] = value
+    @property
+    def properties(self):
+        return self.model.graph.properties(self.id)
+    @property
+    def friends(self):
+        positions, _ = self.model.active_edges(np.array([self.id]))
+        friend_ids, strengths = self.model.graph.indices[positions], self.model.graph.weights[positions]
+        return list(zip(friend_ids.tolist(), strengths.tolist()))
+    def add_connection(self, friend_id, contact_strength=1):
+        """
+            Adds a connection to this individual by rebuilding the model's ContactGraph,
+            see Model.add_edges. Build large networks with ContactGraph.from_edges instead.
+            @params:
+                friend_id: the ID of the friend
+                contact_strength: the strength of the contact [=1]
+        """
+        self.model.add_edges(np.array([self.id]), np.array([friend_id]), np.array([contact_strength]))
+    def describe_friends(self, individuals=None):
+        """
+            Counts the friends of this individual by partition, from the partition codes.
+        """
+        positions, _ = self.model.active_edges(np.array([self.id]))
+        graph = self.model.graph
+        counts = np.bincount(graph.partition_codes[graph.indices[positions]], minlength=len(graph.partition_names))
+        return Counter({ graph.partition_names[code]: int(c) for code, c in enumerate(counts) if c })
+
+
+class IndividualList(object):
+    def __init__(self, model):
+        """
+            A lazy list of IndividualViews over all the individuals of a model.
+        """
+        self.model = model
+    def __len__(self):
+        return self.model.graph.num_individuals if self.model.graph is not None else 0
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [ IndividualView(self.model, j) for j in range(*i.indices(len(self))) ]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('individual index out of range')
+        return IndividualView(self.model, int(i))
+    def __iter__(self):
+        for i in range(len(self)):
+            yield IndividualView(self.model, i)
+
+
+class ContactGraph(object):
+    def __init__(self, indptr, indices, weights, partition_codes, partition_names):
+        """
+            Stores the connections of a network in compressed sparse row form.
+            The friends of individual i are indices[indptr[i]:indptr[i+1]] with
+            contact strengths weights[indptr[i]:indptr[i+1]].
+            Every connection is a directed edge, a symmetric friendship is stored twice.
+            @params:
+                indptr: array of length num_individuals+1 with the offset of each individual
+                indices: the friend ID of each edge
+                weights: the contact strength of each edge
+                partition_codes: the partition index of each individual
+                partition_names: list of the (comma separated) partition names, indexed by code
+        """
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+        self.partition_codes = partition_codes
+        self.partition_names = list(partition_names)
+        self._reverse = None
+        # graphs are shared between forked models, so they are never edited in place
+        for array in (self.indptr, self.indices, self.weights, self.partition_codes):
+            array.flags.writeable = False
+
+    @staticmethod
+    def index_dtype(num_individuals):
+        return np.int32 if num_individuals < 2**31 else np.int64
+
+    @staticmethod
+    def from_edges(num_individuals, sources, targets, weights=None, partition_codes=None, partition_names=None, mirrors=None):
+        """
+            Creates a ContactGraph from parallel arrays of directed edges.
+            @params:
+                num_individuals: the number of individuals in the network
+                sources: the ID of the individual that owns each edge
+                targets: the ID of the friend for each edge
+                weights: the contact strength of each edge [=1]
+                partition_codes: the partition index of each individual [=0]
+                partition_names: the names of the partitions [=[""]]
+                mirrors: for each edge, the index of its reverse edge in these arrays
+                        or -1, so that reverse_edges does not have to search for them [=None]
+        """
+        sources = np.asarray(sources)
+        targets = np.asarray(targets)
+        weights = np.ones(len(sources), dtype=np.float32) if weights is None else np.asarray(weights, dtype=np.float32)
+        if partition_codes is None:
+            partition_codes = np.zeros(num_individuals, dtype=np.int16)
+        if partition_names is None:
+            partition_names = [""]
+
+        order = np.argsort(sources, kind='stable')
+        indptr = np.zeros(num_individuals+1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=num_individuals), out=indptr[1:])
+
+        graph = ContactGraph(indptr,
+            targets[order].astype(ContactGraph.index_dtype(num_individuals)),
+            weights[order],
+            np.asarray(partition_codes, dtype=np.int16),
+            partition_names)
+
+        if mirrors is not None:
+            position = np.empty(len(order), dtype=np.int64)
+            position[order] = np.arange(len(order))
+            mirrors = np.asarray(mirrors)[order]
+            graph._reverse = np.where(mirrors >= 0, position[mirrors], -1)
+        return graph
+
+    @staticmethod
+    def from_individuals(individuals):
+        """
+            Creates a ContactGraph from a list of Individual objects.
+        """
+        partition_names = sorted(set(i.properties for i in individuals))
+        lookup = { p:c for c,p in enumerate(partition_names) }
+        sources, targets, weights = [], [], []
+        for individual in individuals:
+            for fid, c in individual.friends:
+                sources.append(individual.id)
+                targets.append(fid)
+                weights.append(c)
+        return ContactGraph.from_edges(len(individuals),
+            np.array(sources, dtype=np.int64),
+            np.array(targets, dtype=np.int64),
+            weights,
+            [ lookup[i.properties] for i in individuals ],
+            partition_names)
+
+    @property
+    def num_individuals(self):
+        return len(self.indptr) - 1
+
+    @property
+    def num_edges(self):
+        return len(self.indices)
+
+    @property
+    def nbytes(self):
+        return self.indptr.nbytes + self.indices.nbytes + self.weights.nbytes + self.partition_codes.nbytes
+
+    def degree(self):
+        return np.diff(self.indptr)
+
+    def neighbours(self, i):
+        """
+            returns the (friend_ids, contact_strengths) arrays of individual i
+        """
+        return self.indices[self.indptr[i]:self.indptr[i+1]], self.weights[self.indptr[i]:self.indptr[i+1]]
+
+    def edge_positions(self, individuals):
+        """
+            returns the positions (into indices/weights) of every edge owned by
+            the given array of individuals, grouped by individual.
+        """
+        starts = self.indptr[individuals]
+        counts = self.indptr[np.asarray(individuals)+1] - starts
+        offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+        return offsets + np.arange(len(offsets), dtype=np.int64)
+
+    def edge_sources(self):
+        """
+            returns the ID of the individual that owns each edge
+        """
+        return np.repeat(np.arange(self.num_individuals, dtype=self.indices.dtype), self.degree())
+
+    def properties(self, i):
+        return self.partition_names[self.partition_codes[i]]
+
+    def reverse_edges(self):
+        """
+            returns for every edge (i,j) the position of a matching edge (j,i),
+            or -1 if there is none. Parallel edges are paired off one to one.
+        """
+        if self._reverse is None:
+            n = np.int64(self.num_individuals)
+            sources = self.edge_sources().astype(np.int64)
+            targets = self.indices.astype(np.int64)
+
+            # edges sorted by (source, target) and by (target, source).
+            # The k-th edge (j,i) in the first order is the mirror of the k-th edge (i,j) in the second.
+            forward = np.argsort(sources * n + targets, kind='stable')
+            backward = np.argsort(targets * n + sources, kind='stable')
+            forward_keys = (sources * n + targets)[forward]
+            backward_keys = (targets * n + sources)[backward]
+
+            first = np.searchsorted(forward_keys, backward_keys, side='left')
+            count = np.searchsorted(forward_keys, backward_keys, side='right') - first
+            rank = np.arange(len(backward_keys)) - np.searchsorted(backward_keys, backward_keys, side='left')
+            has_mirror = rank < count
+
+            self._reverse = np.full(len(sources), -1, dtype=np.int64)
+            self._reverse[backward[has_mirror]] = forward[first[has_mirror] + rank[has_mirror]]
+        return self._reverse
+
+    def remove_edges(self, removed):
+        """
+            returns a new ContactGraph without the edges flagged in the boolean array removed
+        """
+        keep = ~np.asarray(removed, dtype=bool)
+        kept_before = np.zeros(self.num_edges+1, dtype=np.int64)
+        np.cumsum(keep, out=kept_before[1:])
+        indptr = kept_before[self.indptr]
+        return ContactGraph(indptr, self.indices[keep], self.weights[keep], self.partition_codes, self.partition_names)
+
+    def copy(self):
+        return ContactGraph(self.indptr.copy(), self.indices.copy(), self.weights.copy(),
+            self.partition_codes.copy(), self.partition_names)
@@ -0,0 +1,188 @@
+import numpy as np
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from Model import Model
+
+SCALES = [1000, 10000, 100000, 1000000]
+NUM_SEEDS = 10 # initial infections of the simulate cases
+
+PARTITIONING = {"SCI,1":0.30, "SCI,2":0.2, "HUM,1":0.30, "HUM,2":0.2}
+NUM_CONNECTIONS = {"SCI,1":5, "SCI,2":5, "HUM,1":6, "HUM,2":6}
+FRIEND_DISTRIBUTION = {
+    # within class
+    ("SCI,1","SCI,1"):0.5,
+    ("HUM,1","HUM,1"):0.5,
+    ("HUM,2","HUM,2"):0.5,
+    ("SCI,2","SCI,2"):0.5,
+    ("SCI,1","HUM,1"):0.5,
+    # cross class
+    ("SCI,1","HUM,2"):0,
+    ("HUM,1","SCI,2"):0,
+    # in-cross terms
+    ("SCI,2", "HUM,2"):0.25,
+    ("SCI,1","SCI,2"):0.25,
+    ("HUM,1", "HUM,2"):0.25
+}
+
+
+def random_network(n, seed=1):
+    return Model.random_network(n, 5, list(PARTITIONING.keys()), transmission_rate=0.25, recovery_time=5, seed=seed)
+
+
+def realistic_network(n, seed=1):
+    return Model.create_realistic_network(n, NUM_CONNECTIONS, PARTITIONING, FRIEND_DISTRIBUTION,
+        transmission_rate=0.25, recovery_time=5, seed=seed)
+
+
+def _infected(model, seed=1):
+    """
+        returns a fork of the model with NUM_SEEDS fixed first infections among the
+        individuals that have friends, so the epidemic does not die out on the first day
+    """
+    model = model.fork(seed=seed)
+    connected = np.flatnonzero(model.graph.degree() > 0)
+    for infected_id in model.rng.choice(connected, size=min(NUM_SEEDS, len(connected)), replace=False).tolist():
+        model.introduce_infection(infected_id)
+    return model
+
+
+def _simulate(model, recovery):
+    """
+        Simulates 100 days and returns how much of the epidemic ran, so a run that
+        died out is visible in the results
+    """
+    initial = int(np.count_nonzero(model.state != 0))
+    model.simulate(time=100, recovery=recovery)
+    return { "infections": int(np.count_nonzero(model.state != 0)) - initial, "days": model.total_time }
+
+
+# name -> (setup(network) returning the arguments of run, run(*arguments))
+# a run may return a dict of counters describing the work it did, which is added to its result
+# the network of each scale is built once and setup makes whatever copy the case mutates,
+# so only run is timed.
+CASES = {
+    "random_network": (lambda network: (network.graph.num_individuals,), random_network),
+    "create_realistic_network": (lambda network: (network.graph.num_individuals,), realistic_network),
+    "simulate": (lambda network: (_infected(network),),
+        lambda model: _simulate(model, 'presampled')),
+    "simulate_hazard": (lambda network: (_infected(network),),
+        lambda model: _simulate(model, 'hazard')),
+    "deep_copy": (lambda network: (network,), lambda model: model.deep_copy()),
+    "fork": (lambda network: (network,), lambda model: model.fork()),
+    "delete_random_edges": (lambda network: (network.fork(),),
+        lambda model: model.delete_random_edges(1)),
+    "delete_preferential_edges": (lambda network: (network.fork(),),
+        lambda model: model.delete_preferential_edges(1)),
+    "export_network_csv": (lambda network: (network,),
+        lambda model: model.export_network(format='CSV', file=os.devnull)),
+    "export_network_json": (lambda network: (network,),
+        lambda model: model.export_network(format='JSON', file=os.devnull))
+}
+
+
+def measure(setup, run, network, repeat=3, memory=True):
+    """
+        Times run(*setup(network)) and measures its peak memory.
+        @params:
+            setup: returns the arguments of run, it is not timed
+            run: the function to benchmark
+            network: the Model setup is given
+            repeat[=3]: the number of timed runs, each one on a fresh setup
+            memory[=True]: also does one run under tracemalloc to measure the peak
+                    of the memory allocated by run. It is a separate run as tracing slows it down.
+        returns a dict with the times of every run (seconds), their min and median, the peak memory (bytes)
+        and the counters returned by the last run, if any
+    """
+    times = []
+    counters = None
+    for _ in range(repeat):
+        arguments = setup(network)
+        start = time.perf_counter()
+        counters = run(*arguments)
+        times.append(time.perf_counter() - start)
+        del arguments
+
+    result = {"times": times, "min": min(times), "median": float(np.median(times))}
+    if isinstance(counters, dict):
+        result.update(counters)
+    if memory:
+        arguments = setup(network)
+        tracemalloc.start()
+        try:
+            run(*arguments)
+            result["peak_memory"] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def run_benchmarks(scales=SCALES, cases=None, repeat=3, memory=True, network=realistic_network, log=None):
+    """
+        Runs the benchmark cases at several network sizes.
+        @params:
+            scales[=SCALES]: the numbers of individuals to benchmark at
+            cases[=None]: the names of the CASES to run (=all of them)
+            repeat[=3]: the number of timed runs of every case
+            memory[=True]: measure the peak memory of every case
+            network[=realistic_network]: function(n, seed) that builds the network the cases run on
+            log[=None]: a file to report progress to, eg: sys.stderr
+        returns a JSON serializable dict with the environment and a list of results,
+        one {"case", "num_individuals", "num_edges", "times", "min", "median", "peak_memory"} per case and scale,
+        the simulate cases also report the number of "infections" and the "days" run
+    """
+    cases = cases or list(CASES.keys())
+    results = []
+    for n in scales:
+        model = network(n, 1)
+        for name in cases:
+            setup, run = CASES[name]
+            result = { "case": name, "num_individuals": n, "num_edges": int(model.graph.num_edges) }
+            result.update(measure(setup, run, model, repeat=repeat, memory=memory))
+            results.append(result)
+            if log:
+                log.write('%-26s n=%-8d median=%.4fs%s%s\n' % (name, n, result["median"],
+                    ' peak=%.1fMB' % (result["peak_memory"] / 1e6) if memory else '',
+                    ' infections=%d' % result["infections"] if "infections" in result else ''))
+                log.flush()
+        #endfor
+        del model
+    #endfor
+
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "repeat": repeat,
+        "results": results
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks network generation, simulation, copying, edge deletion and export.')
+    parser.add_argument('--scales', type=int, nargs='+', default=SCALES, help='numbers of individuals')
+    parser.add_argument('--cases', nargs='+', choices=list(CASES.keys()), help='cases to run (default: all)')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per case')
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc run')
+    parser.add_argument('--network', choices=['realistic', 'random'], default='realistic', help='network the cases run on')
+    parser.add_argument('--output', default=None, help='JSON file to write the results to (default: stdout)')
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(args.scales, args.cases, repeat=args.repeat, memory=not args.no_memory,
+        network=realistic_network if args.network == 'realistic' else random_network, log=sys.stderr)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+import numpy as np
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+import Export
+
+STALE_SECONDS = 3600 # age after which a temporary directory is taken to be left behind by a crashed writer
+
+
+def _fingerprint(value, digest):
+    """
+        Feeds a description of a generator parameter into a hashlib digest.
+    """
+    if isinstance(value, np.generic):
+        # numpy scalars key like the python ones, eg: seed=np.int64(1) and seed=1
+        _fingerprint(value.item(), digest)
+    elif isinstance(value, np.random.SeedSequence):
+        digest.update(b'SeedSequence:')
+        _fingerprint([value.entropy, value.spawn_key, value.pool_size], digest)
+    elif isinstance(value, np.random.Generator):
+        digest.update(b'Generator:')
+        _fingerprint(value.bit_generator.state, digest)
+    elif isinstance(value, np.random.BitGenerator):
+        digest.update(b'BitGenerator:')
+        _fingerprint(value.state, digest)
+    elif isinstance(value, np.ndarray):
+        digest.update(('ndarray:%s:%s:' % (value.dtype.str, value.shape)).encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, dict):
+        digest.update(b'dict:')
+        for k in sorted(value, key=repr):
+            _fingerprint(k, digest)
+            _fingerprint(value[k], digest)
+    elif isinstance(value, (list, tuple)):
+        digest.update(('%s:%d:' % (type(value).__name__, len(value))).encode())
+        for v in value:
+            _fingerprint(v, digest)
+    elif hasattr(value, '__call__'):
+        raise TypeError('Can not hash the function '+repr(value)+', pass an explicit key instead.')
+    else:
+        digest.update((type(value).__name__+':'+repr(value)+';').encode())
+
+
+class NetworkCache(object):
+    def __init__(self, directory, max_bytes=None):
+        """
+            A persistent cache of generated networks stored as memory-mappable arrays.
+            Entries are written to a temporary directory and renamed into place, so
+            concurrent writers of the same network never see a half written entry
+            (the first rename wins). Readers map the network read-only.
+            @params:
+                directory: where the cache lives (created if needed)
+                max_bytes[=None]: size budget, the least recently used entries are
+                        evicted once it is exceeded
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        if not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(builder, *args, **kwargs):
+        """
+            returns the cache key of builder(*args, **kwargs)
+        """
+        digest = hashlib.sha256()
+        _fingerprint(getattr(builder, '__module__', '')+'.'+getattr(builder, '__qualname__', repr(builder)), digest)
+        _fingerprint(args, digest)
+        _fingerprint(kwargs, digest)
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        """
+            returns the cached Model for a key with its network mapped read-only, or None
+        """
+        path = self.path(key)
+        try:
+            model = Export.load_arrays(path, mmap_mode='r')
+            with open(os.path.join(path, 'rng.json')) as f:
+                state = json.load(f)
+        except (IOError, OSError):
+            return None
+        model.rng = Export.restore_rng(state)
+        # mark the entry as recently used
+        os.utime(path, None)
+        return model
+
+    def put(self, key, model):
+        """
+            Stores a model under a key. If another process stored it first, theirs is kept.
+        """
+        path = self.path(key)
+        tmp = os.path.join(self.directory, '.tmp-'+key+'-'+uuid.uuid4().hex)
+        Export.save_arrays(model, tmp)
+        with open(os.path.join(tmp, 'rng.json'), 'w') as f:
+            json.dump(model.rng.bit_generator.state, f)
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            # somebody else already wrote this entry
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.evict()
+
+    def build(self, builder, *args, **kwargs):
+        """
+            Returns builder(*args, **kwargs) from the cache, building and storing it first if needed.
+            The returned model continues the random stream the builder left off at,
+            so a cached network simulates exactly like a freshly built one.
+            @params:
+                builder: the network generator, eg: Model.random_network
+                key[=None]: explicit cache key, needed when a parameter is a function
+        """
+        key = kwargs.pop('key', None) or NetworkCache.key(builder, *args, **kwargs)
+        model = self.get(key)
+        if model is None:
+            built = builder(*args, **kwargs)
+            self.put(key, built)
+            # the entry may already be gone if it alone is larger than max_bytes
+            model = self.get(key) or built
+        return model
+
+    def entries(self):
+        """
+            returns a list of (last_used, size_in_bytes, key) of the cached networks
+        """
+        entries = []
+        for key in os.listdir(self.directory):
+            path = self.path(key)
+            if key.startswith('.') or not os.path.isdir(path):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+                entries.append((os.path.getmtime(path), size, key))
+            except OSError:
+                continue # evicted by someone else meanwhile
+        return entries
+
+    def remove_stale(self, max_age=STALE_SECONDS):
+        """
+            Removes the temporary directories that writers which crashed left behind.
+            @params:
+                max_age[=STALE_SECONDS]: seconds since their last change, younger ones may still be written
+        """
+        now = time.time()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if not (name.startswith('.tmp-') or name.startswith('.evicted-')):
+                continue
+            try:
+                if now - os.path.getmtime(path) > max_age:
+                    shutil.rmtree(path, ignore_errors=True)
+            except OSError:
+                continue # removed by someone else meanwhile
+
+    def evict(self):
+        """
+            Removes the least recently used networks until the cache fits in max_bytes,
+            after removing the stale temporary directories.
+            Processes that already mapped an evicted network keep their mapping.
+        """
+        self.remove_stale()
+        if self.max_bytes is None:
+            return
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            trash = os.path.join(self.directory, '.evicted-'+key+'-'+uuid.uuid4().hex)
+            try:
+                # renaming first makes the removal atomic for readers
+                os.rename(self.path(key), trash)
+            except OSError:
+                continue
+            shutil.rmtree(trash, ignore_errors=True)
+            total -= size
@@ -0,0 +1,213 @@
+import numpy as np
+import itertools
+import json
+import multiprocessing
+import os
+
+# the networks and the best score so far, set in every worker by _init_worker
+_networks = {}
+_best = None
+
+
+def load_curve(f):
+    """
+        Reads an observed (t, i) series from a CSV file, with or without a t,i header.
+        returns the (times, infecteds) arrays sorted by time.
+    """
+    rows = []
+    with open(f) as lines:
+        for line in lines:
+            fields = line.strip().split(',')
+            if len(fields) < 2:
+                continue
+            try:
+                rows.append((int(float(fields[0])), float(fields[1])))
+            except ValueError:
+                continue # the header
+    rows.sort()
+    return np.array([ t for t, _ in rows ], dtype=np.int64), np.array([ i for _, i in rows ])
+
+
+def infect_one(model):
+    """
+        The default scenario, introduces a single random infection.
+    """
+    model.introduce_infection()
+
+
+class _Scorer(object):
+    def __init__(self, times, observed, bound):
+        """
+            Simulation observer that adds up the squared error of the run on the observed days.
+            The error only grows, so the run is stopped as soon as it is above bound.
+            If the epidemic dies out the rest of the error is known without running the
+            remaining days: the squared observed counts.
+        """
+        self.times = times
+        self.observed = observed
+        self.bound = bound
+        self.error = 0.0
+        self.next = 0
+        self.stopped = False
+
+    def __call__(self, model, stats):
+        while self.next < len(self.times) and self.times[self.next] <= stats["day"]:
+            if self.times[self.next] == stats["day"]:
+                self.error += (stats["num_infected"] - self.observed[self.next])**2
+            self.next += 1
+        if stats["num_infected"] == 0 and stats["backlog"] == 0:
+            self.error += float(np.sum(self.observed[self.next:]**2))
+            self.next = len(self.times)
+            return True
+        if self.error > self.bound:
+            self.stopped = True
+            return True
+        return self.next >= len(self.times)
+
+
+def _init_worker(networks, best):
+    global _networks, _best
+    _networks = networks
+    _best = best
+
+
+def _run_point(args):
+    """
+        Scores one parameter point in a worker.
+        The mean squared error over the replicates is only finished while it can still
+        beat the best score so far. Every replicate uses the same seeds at every point,
+        so points are compared on the same random numbers.
+    """
+    point, times, observed, num_replicates, seed, scenario, recovery = args
+    network = _networks[point["network"]]
+    best = _best.value if _best is not None else np.inf
+    num_points = len(times)
+
+    total = 0.0
+    stopped = False
+    for r in range(num_replicates):
+        model = network.fork(seed=[seed, r])
+        model.transmission_rate = point["transmission_rate"]
+        model.recovery_time = point["recovery_time"]
+        scenario(model)
+        # the replicates left can only add to the error
+        scorer = _Scorer(times, observed, (best * num_replicates * num_points) - total)
+        model.simulate(time=int(times[-1]) + 1, recovery=recovery, observers=[scorer])
+        total += scorer.error
+        if scorer.stopped:
+            stopped = True
+            break
+    #endfor
+
+    score = total / (num_replicates * num_points)
+    if not stopped and _best is not None:
+        with _best.get_lock():
+            _best.value = min(_best.value, score)
+    result = dict(point)
+    result.update(score=float(score), stopped=stopped)
+    return result
+
+
+def _scalar(value):
+    """
+        returns numpy scalars (eg: from np.arange) as python ones, so points can be written as JSON
+    """
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def _point_key(point, num_replicates, seed):
+    return json.dumps([point["network"], point["transmission_rate"], point["recovery_time"], num_replicates, seed])
+
+
+def calibrate(networks,
+    observed,
+    grid,
+    num_replicates=5,
+    seed=0,
+    scenario=infect_one,
+    recovery='presampled',
+    processes=None,
+    results=None):
+    """
+        Fits transmission_rate and recovery_time to an observed curve by scoring every
+        point of a parameter grid across a process pool. Each network is built once and
+        every point forks it. A run is stopped as soon as its error can no longer beat the
+        best score so far, and the score of the point is then only a lower bound.
+        @params:
+            networks: a Model, or a dict of name to Model for several structural settings
+            observed: the (times, infecteds) series to fit, eg: load_curve('empirica.csv'),
+                    day t of a simulation is compared to time t
+            grid: dict with lists of "transmission_rate" and "recovery_time" values
+                    (and "network" names, by default all of them) whose product is swept,
+                    OR a list of point dicts with those keys, eg: from a random search
+            num_replicates[=5]: the number of runs averaged at each point
+            seed[=0]: seed of the replicates, the same for every point
+            scenario[=infect_one]: function(model) that starts the epidemic on a fork of the network.
+                    It must be picklable.
+            recovery[='presampled']: passed on to simulate
+            processes[=None]: the number of worker processes (=os.cpu_count()), 1 runs in this process
+            results[=None]: a JSON-lines file the scored points are appended to. Points already
+                    in it are not run again, so an interrupted sweep resumes where it stopped.
+        returns the list of scored points, best first. Each one is a dict with network,
+        transmission_rate, recovery_time, score (the mean squared error per observed day)
+        and stopped (True if the score is a lower bound).
+    """
+    if not isinstance(networks, dict):
+        networks = { "network": networks }
+    times, infecteds = np.asarray(observed[0], dtype=np.int64), np.asarray(observed[1], dtype=float)
+    order = np.argsort(times, kind='stable')
+    times, infecteds = times[order], infecteds[order]
+
+    if isinstance(grid, dict):
+        names = grid.get("network", list(networks.keys()))
+        points = [ { "network": n, "transmission_rate": b, "recovery_time": g }
+            for n, b, g in itertools.product(names, grid["transmission_rate"], grid["recovery_time"]) ]
+    else:
+        points = [ dict(p, network=p.get("network", list(networks.keys())[0])) for p in grid ]
+    points = [ { key: _scalar(value) for key, value in p.items() } for p in points ]
+
+    done = {}
+    if results is not None and os.path.exists(results):
+        with open(results) as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    continue # a line cut short by an interrupted sweep
+                done[_point_key(result, result["num_replicates"], result["seed"])] = result
+    scored = [ done[_point_key(p, num_replicates, seed)] for p in points if _point_key(p, num_replicates, seed) in done ]
+    # the points of one network run one after the other
+    todo = sorted([ p for p in points if _point_key(p, num_replicates, seed) not in done ],
+        key=lambda p: (p["network"], p["transmission_rate"], p["recovery_time"]))
+
+    completed = [ r["score"] for r in scored if not r["stopped"] ]
+    best = multiprocessing.Value('d', min(completed) if completed else np.inf)
+    jobs = [ (p, times, infecteds, num_replicates, seed, scenario, recovery) for p in todo ]
+
+    out = open(results, 'a') if results is not None else None
+    pool = None
+    try:
+        if processes == 1:
+            _init_worker(networks, best)
+            new_results = map(_run_point, jobs)
+        else:
+            pool = multiprocessing.Pool(processes, initializer=_init_worker, initargs=(networks, best))
+            new_results = pool.imap_unordered(_run_point, jobs)
+        for result in new_results:
+            result.update(num_replicates=num_replicates, seed=seed)
+            scored.append(result)
+            if out is not None:
+                out.write(json.dumps(result) + '\n')
+                out.flush()
+        #endfor
+    finally:
+        if out is not None:
+            out.close()
+        if processes == 1:
+            _init_worker({}, None)
+        elif pool is not None:
+            pool.close()
+            pool.join()
+
+    # points that were stopped early sort after every completed point
+    return sorted(scored, key=lambda r: (r["stopped"], r["score"]))
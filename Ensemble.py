@@ -0,0 +1,82 @@
+import numpy as np
+import multiprocessing
+
+
+def default_scenario(model, time=100):
+    """
+        Introduces a single random infection and simulates the model.
+        returns the (time, num_infected) data of the run.
+    """
+    model.introduce_infection()
+    return model.simulate(time=time, return_data=True)
+
+
+def _run_replicate(args):
+    """
+        Builds and runs one replicate in a worker.
+        Only the infected-count curve is sent back to the parent.
+    """
+    build_network, scenario, seed_sequence = args
+    model = build_network(seed=np.random.default_rng(seed_sequence))
+    data = scenario(model)
+    if len(data) and data[0] == ('time', 'num_infected'):
+        data = data[1:]
+    return np.array([ i for _, i in data ], dtype=np.int64)
+
+
+def run_ensemble(build_network,
+    num_replicates,
+    scenario=default_scenario,
+    seed=None,
+    processes=None,
+    quantiles=(0.05, 0.5, 0.95)):
+    """
+        Runs independent replicates of a scenario across a process pool and
+        aggregates their infected-count curves.
+        @params:
+            build_network: function called as build_network(seed=rng) that returns a Model.
+                    It must be picklable, eg: functools.partial(Model.random_network, 2000, 5, ["A","B"])
+            num_replicates: the number of replicates to run
+            scenario[=default_scenario]: function that runs a model and returns its
+                    (time, num_infected) data, like simulate(return_data=True)
+            seed[=None]: root seed, every replicate gets its own np.random.Generator
+                    spawned from np.random.SeedSequence(seed)
+            processes[=None]: the number of worker processes (=os.cpu_count()), 1 runs in this process
+            quantiles[=(0.05,0.5,0.95)]: the quantiles of the infected-count curves to report
+        returns a dict with:
+            time: the days of the curves
+            mean: the mean number of infecteds on each day
+            quantiles: dict of quantile to the curve of that quantile
+            peak_day: the day of the peak of each replicate
+            peak_size: the number of infecteds at the peak of each replicate
+            curves: the (num_replicates, days) array of infected counts.
+                    Runs that stopped early (eg: with until) are padded with NaN.
+    """
+    seed_sequences = np.random.SeedSequence(seed).spawn(num_replicates)
+    jobs = [ (build_network, scenario, s) for s in seed_sequences ]
+
+    if processes == 1:
+        results = list(map(_run_replicate, jobs))
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            chunksize = max(1, num_replicates // (4 * (processes or multiprocessing.cpu_count())))
+            results = pool.map(_run_replicate, jobs, chunksize=chunksize)
+        finally:
+            pool.close()
+            pool.join()
+
+    days = max(len(r) for r in results) if results else 0
+    curves = np.full((num_replicates, days), np.nan)
+    for row, result in zip(curves, results):
+        row[:len(result)] = result
+
+    filled = np.nan_to_num(curves, nan=-1)
+    return {
+        "time": np.arange(days),
+        "mean": np.nanmean(curves, axis=0),
+        "quantiles": { q: np.nanquantile(curves, q, axis=0) for q in quantiles },
+        "peak_day": filled.argmax(axis=1),
+        "peak_size": filled.max(axis=1).astype(np.int64),
+        "curves": curves
+    }
@@ -0,0 +1,139 @@
+import numpy as np
+import heapq
+import math
+
+
+def simulate_events(model, time=100, until=None, daily_onset=True):
+    """
+        Runs the epidemic as a continuous-time event simulation (next-reaction method).
+        Instead of re-examining every friend of every infected each day, each infection
+        draws its infectious period once and schedules one transmission event per
+        susceptible friend, at an exponential delay with the daily hazard
+        -log(1 - transmission_rate), if it falls before the infected recovers.
+        Events are kept in a priority queue and a friend that was already
+        infected when its event fires is skipped, so every edge is touched at most once.
+        @params:
+            model: the Model to run, its state is updated like Model.simulate does
+            time[=100]: the number of days to simulate
+            until[=None]: stops at the end of the first day with more than this many infecteds
+            daily_onset[=True]: infections only become infectious at the start of the next day,
+                    or after the weekend backlog, like in Model.simulate.
+                    If False infecteds are infectious right away.
+        returns the same [('time', 'num_infected'), (t, num_infected), ...] data as simulate(return_data=True)
+        (!) the infectious period is drawn once per infection (draw_recovery_ages + 1 days),
+            like simulate's 'presampled' recovery.
+    """
+    graph = model.graph
+    rng = model.rng
+    N = graph.num_individuals
+    hazard = -np.log1p(-model.transmission_rate) if model.transmission_rate < 1 else np.inf
+    start_time = model.total_time
+
+    susceptible = model.state == 0
+    infected_at = np.full(N, np.inf)
+    onset = np.full(N, np.inf)
+    recovery = np.full(N, np.inf)
+
+    # changes in the number of infecteds counted at the end of each day
+    diff = np.zeros(time+1, dtype=np.int64)
+    num_infected = np.zeros(time, dtype=np.int64)
+    queue = []
+    day = 0
+    recovery_times = []
+
+    def draw_recovery_time():
+        # recovery ages are drawn in blocks to keep rng calls off the per-event path
+        if not recovery_times:
+            recovery_times.extend(model.draw_recovery_ages(np.zeros(4096, dtype=np.int64)).tolist())
+        return recovery_times.pop()
+
+    def become_infectious(u, start, end):
+        onset[u] = start
+        recovery[u] = end
+        # counted at the end of day t when start <= t+1 < end
+        first = max(math.ceil(start) - 1, day)
+        last = min(math.ceil(end) - 2, time - 1)
+        if first <= last:
+            diff[first] += 1
+            diff[last+1] -= 1
+
+        # schedule a transmission to every susceptible friend
+        if hazard <= 0:
+            return
+        friends = graph.indices[graph.indptr[u]:graph.indptr[u+1]]
+        if model.removed_edges is not None:
+            friends = friends[~model.removed_edges[graph.indptr[u]:graph.indptr[u+1]]]
+        friends = friends[susceptible[friends]]
+        if len(friends) == 0:
+            return
+        delays = rng.exponential(1.0/hazard, size=len(friends)) if np.isfinite(hazard) else np.zeros(len(friends))
+        times = max(start, 0.0) + delays
+        scheduled = (times < end) & (times < time)
+        for t, v in zip(times[scheduled].tolist(), friends[scheduled].tolist()):
+            heapq.heappush(queue, (t, v))
+
+    # the current infecteds became infectious time_since_infected days ago
+    initial = model.infecteds
+    started = -model.time_since_infected[initial].astype(float)
+    ends = np.maximum(started + model.draw_recovery_ages(model.time_since_infected[initial]) + 1, 1)
+    susceptible[initial] = False
+    infected_at[initial] = 0
+    for u, start, end in zip(initial.tolist(), started.tolist(), ends.tolist()):
+        become_infectious(u, start, end)
+    # and the ones in the weekend backlog once it is over
+    waiting = np.concatenate([np.zeros(0, dtype=np.int64)] + model.backlog)
+    release = float(model.release_step(start_time + 1) - start_time) if daily_onset else 0.0
+    susceptible[waiting] = False
+    infected_at[waiting] = 0
+    for u in waiting.tolist():
+        become_infectious(u, release, release + draw_recovery_time() + 1)
+
+    running = 0
+    stopped = False
+    while day < time and not stopped:
+        next_time = queue[0][0] if queue else np.inf
+
+        # close every day that ends before the next event
+        while day < time and next_time >= day + 1:
+            running += diff[day]
+            num_infected[day] = running
+            day += 1
+            if until and num_infected[day-1] > until:
+                stopped = True
+                break
+        if day >= time or stopped:
+            break
+
+        tau, v = heapq.heappop(queue)
+        if not susceptible[v]:
+            continue
+        susceptible[v] = False
+        infected_at[v] = tau
+
+        if daily_onset:
+            # infecteds are released at the end of the first weekday from their day of infection
+            release = model.release_step(start_time + int(tau) + 1) - start_time
+            start = float(release)
+        else:
+            start = tau
+        become_infectious(v, start, start + draw_recovery_time() + 1)
+    #endwhile
+
+    # write the state at the end of the last simulated day back to the model
+    end = float(day)
+    infected = infected_at < end
+    model.state[infected] = np.where(recovery[infected] <= end, 2, 1)
+    model.recount()
+    model.infecteds = np.flatnonzero(infected & (onset <= end) & (recovery > end))
+    waiting = np.flatnonzero(infected & (onset > end) & (recovery > end))
+    model.backlog = [waiting] if len(waiting) else []
+    newly_infected = infected & (infected_at > 0)
+    model.time_since_infected[newly_infected] = 0
+    model.time_since_infected[model.infecteds] = np.floor(end - onset[model.infecteds]).astype(model.time_since_infected.dtype)
+    # the day loop draws new recovery days for the infecteds left over
+    model.recovery_day[infected] = -1
+    model.total_time += day
+    # and must not find them under their old ones
+    model.rebuild_recovery_calendar()
+
+    return [('time', 'num_infected')] + [ (t, int(num_infected[t])) for t in range(day) ]
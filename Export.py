@@ -0,0 +1,277 @@
+import numpy as np
+import json
+import os
+from BaseObjects import ContactGraph
+from Model import Model
+
+CHUNK_SIZE = 100000 # number of edges formatted at a time
+
+
+def _chunks(model, chunk_size):
+    """
+        Yields (sources, targets, weights) chunks of the edges of a model that have not been removed.
+    """
+    graph = model.graph
+    for start in range(0, graph.num_edges, chunk_size):
+        stop = min(start + chunk_size, graph.num_edges)
+        # the owner of each edge in the chunk, found from indptr
+        sources = np.searchsorted(graph.indptr, np.arange(start, stop), side='right') - 1
+        targets = graph.indices[start:stop]
+        weights = graph.weights[start:stop]
+        if model.removed_edges is not None:
+            kept = ~model.removed_edges[start:stop]
+            sources, targets, weights = sources[kept], targets[kept], weights[kept]
+        yield sources, targets, weights
+
+
+def _opened(f, mode):
+    """
+        returns (file, should_close) for a path or an already open file
+    """
+    if isinstance(f, (str, bytes, os.PathLike)):
+        return open(f, mode), True
+    return f, False
+
+
+def write_csv(model, f, chunk_size=CHUNK_SIZE):
+    """
+        Writes the edges of a model as source,target,strength,class,state rows,
+        the same layout as Model.edge_list.
+        @params:
+            model: the Model to export
+            f: a path or a text file handle
+            chunk_size: the number of edges formatted at a time
+    """
+    f, should_close = _opened(f, 'w')
+    try:
+        f.write('source,target,strength,class,state\n')
+        classes = [ p.replace(',','') for p in model.graph.partition_names ]
+        for sources, targets, weights in _chunks(model, chunk_size):
+            codes = model.graph.partition_codes[sources].tolist()
+            states = model.state[sources].tolist()
+            f.write(''.join('%d,%d,%g,%s,%d\n' % (i, fid, c, classes[code], state)
+                for i, fid, c, code, state in zip(sources.tolist(), targets.tolist(), weights.tolist(), codes, states)))
+    finally:
+        if should_close:
+            f.close()
+
+
+def _node_records(model, chunk_size):
+    groups = [ json.dumps(p) for p in model.graph.partition_names ]
+    for start in range(0, model.graph.num_individuals, chunk_size):
+        stop = min(start + chunk_size, model.graph.num_individuals)
+        codes = model.graph.partition_codes[start:stop].tolist()
+        states = model.state[start:stop].tolist()
+        yield [ '{"name":%d,"group":%s,"state":%d' % (i, groups[code], state)
+            for i, code, state in zip(range(start, stop), codes, states) ]
+
+
+def _link_records(model, chunk_size):
+    for sources, targets, weights in _chunks(model, chunk_size):
+        yield [ '{"source":%d,"target":%d,"value":%g' % (i, fid, c)
+            for i, fid, c in zip(sources.tolist(), targets.tolist(), weights.tolist()) ]
+
+
+def write_jsonl(model, f, chunk_size=CHUNK_SIZE):
+    """
+        Writes a model as JSON-lines. Every individual is a
+        {"type":"node","name","group","state"} line followed by every edge
+        as a {"type":"link","source","target","value"} line.
+        @params:
+            model: the Model to export
+            f: a path or a text file handle
+            chunk_size: the number of records formatted at a time
+    """
+    f, should_close = _opened(f, 'w')
+    try:
+        for records in _node_records(model, chunk_size):
+            f.write(''.join(r + ',"type":"node"}\n' for r in records))
+        for records in _link_records(model, chunk_size):
+            f.write(''.join(r + ',"type":"link"}\n' for r in records))
+    finally:
+        if should_close:
+            f.close()
+
+
+def write_d3_json(model, f, chunk_size=CHUNK_SIZE):
+    """
+        Writes a model as the {"nodes":[...], "links":[...]} JSON document
+        that Graph2.html (and Model.export_network) uses.
+        @params:
+            model: the Model to export
+            f: a path or a text file handle
+            chunk_size: the number of records formatted at a time
+    """
+    f, should_close = _opened(f, 'w')
+    try:
+        for key, records in (('nodes', _node_records(model, chunk_size)), ('links', _link_records(model, chunk_size))):
+            f.write('{"nodes":[' if key == 'nodes' else '],"links":[')
+            separator = ''
+            for chunk in records:
+                if chunk:
+                    f.write(separator + '},'.join(chunk) + '}')
+                    separator = ','
+        f.write(']}\n')
+    finally:
+        if should_close:
+            f.close()
+
+
+def _model_arrays(model):
+    arrays = {
+        "indptr": model.graph.indptr,
+        "indices": model.graph.indices,
+        "weights": model.graph.weights,
+        "partition_codes": model.graph.partition_codes,
+        "partition_names": np.array(model.graph.partition_names, dtype=str),
+        "state": model.state,
+        "time_since_infected": model.time_since_infected,
+        "recovery_day": model.recovery_day,
+        "infecteds": model.infecteds,
+        "backlog": np.concatenate([np.zeros(0, dtype=np.int64)] + model.backlog),
+        "states": np.array(model.states),
+        "parameters": np.array([model.transmission_rate, model.recovery_time, model.total_time], dtype=float)
+    }
+    if model.removed_edges is not None:
+        arrays["removed_edges"] = model.removed_edges
+    return arrays
+
+
+def _model_from_arrays(arrays, seed=1, graph=None):
+    transmission_rate, recovery_time, total_time = arrays["parameters"].tolist()
+    model = Model(transmission_rate, recovery_time, states=arrays["states"].tolist(), seed=seed)
+    model.graph = graph if graph is not None else ContactGraph(arrays["indptr"], arrays["indices"], arrays["weights"],
+        arrays["partition_codes"], arrays["partition_names"].tolist())
+    model.state = np.array(arrays["state"])
+    model.time_since_infected = np.array(arrays["time_since_infected"])
+    model.infecteds = np.array(arrays["infecteds"])
+    model.backlog = [ np.array(arrays["backlog"]) ] if len(arrays.get("backlog", [])) else []
+    model.removed_edges = np.array(arrays["removed_edges"]) if "removed_edges" in arrays else None
+    model.total_time = int(total_time)
+    model.recovery_day = np.array(arrays["recovery_day"]) if "recovery_day" in arrays else np.full(len(model.state), -1, dtype=np.int32)
+    model.rebuild_recovery_calendar()
+    model.recount()
+    return model
+
+
+def save_npz(model, f):
+    """
+        Saves the network and state of a model to a single .npz file.
+        @params:
+            model: the Model to save
+            f: a path or a binary file handle
+    """
+    np.savez(f, **_model_arrays(model))
+
+
+def load_npz(f, seed=1):
+    """
+        Loads a model saved with save_npz.
+        @params:
+            f: a path or a binary file handle
+            seed[=1]: seed of the loaded model's random stream
+    """
+    with np.load(f, allow_pickle=False) as data:
+        return _model_from_arrays({ key: data[key] for key in data.files }, seed=seed)
+
+
+def save_arrays(model, directory):
+    """
+        Saves the network and state of a model as one raw .npy file per array,
+        which load_arrays can memory-map.
+        @params:
+            model: the Model to save
+            directory: the directory to write the arrays to (created if needed)
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    for key, array in _model_arrays(model).items():
+        np.save(os.path.join(directory, key + '.npy'), array, allow_pickle=False)
+
+
+def load_arrays(directory, mmap_mode=None, seed=1):
+    """
+        Loads a model saved with save_arrays.
+        @params:
+            directory: the directory the arrays were saved to
+            mmap_mode[=None]: passed to np.load, eg: 'r' maps the network read-only
+                    instead of reading it. The per-individual state is always copied.
+            seed[=1]: seed of the loaded model's random stream
+    """
+    arrays = {}
+    for name in os.listdir(directory):
+        if name.endswith('.npy'):
+            arrays[name[:-4]] = np.load(os.path.join(directory, name), mmap_mode=mmap_mode, allow_pickle=False)
+    return _model_from_arrays(arrays, seed=seed)
+
+
+GRAPH_ARRAYS = ["indptr", "indices", "weights", "partition_codes", "partition_names"]
+
+
+def restore_rng(state):
+    """
+        returns a np.random.Generator continuing from a saved rng.bit_generator.state
+    """
+    bit_generator = getattr(np.random, state['bit_generator'])()
+    bit_generator.state = state
+    return np.random.Generator(bit_generator)
+
+
+def save_checkpoint(model, f, include_graph=True):
+    """
+        Saves a simulation in progress to a compressed .npz file: the state of every
+        individual, the infecteds and the weekend backlog, the removed edges, total_time,
+        the interventions that fired and the state of the model's random stream, so that the run resumes exactly where
+        it stopped (pending recovery days are refiled from recovery_day on load).
+        @params:
+            model: the Model to save
+            f: a path or a binary file handle
+            include_graph[=True]: also saves the network. Without it the checkpoint is only
+                    the per-individual state, and load_checkpoint must be given the network,
+                    eg: to branch many runs off one prefix of a cached network.
+    """
+    arrays = _model_arrays(model)
+    if not include_graph:
+        for key in GRAPH_ARRAYS:
+            del arrays[key]
+    if model.removed_edges is not None:
+        arrays["removed_edges"] = np.packbits(model.removed_edges)
+    arrays["num_edges"] = np.array([model.graph.num_edges, model.graph.num_individuals], dtype=np.int64)
+    arrays["rng_state"] = np.array(json.dumps(model.rng.bit_generator.state))
+    arrays["interventions_fired"] = np.array(json.dumps(model.interventions_fired))
+    np.savez_compressed(f, **arrays)
+
+
+def load_checkpoint(f, network=None):
+    """
+        Loads a model saved with save_checkpoint, with its random stream where it was saved.
+        @params:
+            f: a path or a binary file handle
+            network[=None]: the Model or ContactGraph the checkpoint was taken on,
+                    required if it was saved without include_graph
+    """
+    with np.load(f, allow_pickle=False) as data:
+        arrays = { key: data[key] for key in data.files }
+    num_edges, num_individuals = arrays["num_edges"].tolist()
+    graph = getattr(network, 'graph', network)
+    if graph is not None:
+        assert (graph.num_edges, graph.num_individuals) == (num_edges, num_individuals), \
+            'The checkpoint was taken on a network with '+str(num_individuals)+' individuals and '+str(num_edges)+' edges.'
+    elif "indptr" not in arrays:
+        raise ValueError('The checkpoint does not include the network, pass it as network.')
+    if "removed_edges" in arrays:
+        arrays["removed_edges"] = np.unpackbits(arrays["removed_edges"], count=num_edges).astype(bool)
+
+    model = _model_from_arrays(arrays, graph=graph)
+    model.rng = restore_rng(json.loads(str(arrays["rng_state"])))
+    if "interventions_fired" in arrays:
+        model.interventions_fired = json.loads(str(arrays["interventions_fired"]))
+    return model
+
+
+WRITERS = {
+    "CSV": write_csv,
+    "JSONL": write_jsonl,
+    "JSON": write_d3_json,
+    "NPZ": save_npz
+}
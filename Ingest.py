@@ -0,0 +1,355 @@
+import numpy as np
+import os
+import sys
+from timeit import default_timer as timer
+from BaseObjects import ContactGraph
+from Model import Model
+
+CHUNK_ROWS = 1 << 18 # rows or records of a file read at a time
+
+# the columns of Model.edge_list and Export.write_csv
+COLUMNS = ['source', 'target', 'strength', 'class', 'state']
+
+
+class IdMap(object):
+    def __init__(self):
+        """
+            Gives arbitrary external IDs (strings or integers) dense integer IDs 0..N-1,
+            in the order they are first seen. The known IDs are kept sorted, so a chunk
+            is remapped with a searchsorted of its distinct IDs.
+        """
+        self.keys = None # the known IDs, sorted
+        self.codes = np.zeros(0, dtype=np.int64) # the dense ID of each of keys
+        self.external = [] # arrays of the external IDs, in dense ID order
+
+    def __len__(self):
+        return len(self.codes)
+
+    def remap(self, ids):
+        """
+            returns the dense IDs of an array of external IDs, new IDs get the next free ones.
+        """
+        unique, first, inverse = np.unique(ids, return_index=True, return_inverse=True)
+        if self.keys is None:
+            self.keys = unique[:0]
+        elif unique.dtype != self.keys.dtype:
+            # eg: longer strings than the ones seen so far
+            dtype = np.promote_types(self.keys.dtype, unique.dtype)
+            self.keys, unique = self.keys.astype(dtype), unique.astype(dtype)
+        positions = np.searchsorted(self.keys, unique)
+        known = positions < len(self.keys)
+        known[known] = self.keys[positions[known]] == unique[known]
+
+        dense = np.empty(len(unique), dtype=np.int64)
+        dense[known] = self.codes[positions[known]]
+        new = np.flatnonzero(~known)
+        if len(new):
+            # number the new IDs by their first appearance in the chunk
+            new = new[np.argsort(first[new], kind='stable')]
+            dense[new] = np.arange(len(self), len(self) + len(new))
+            self.external.append(unique[new])
+            at = positions[~known]
+            self.keys = np.insert(self.keys, at, unique[~known])
+            self.codes = np.insert(self.codes, at, dense[~known])
+        return dense[inverse.ravel()]
+
+    def ids(self):
+        """
+            returns the array of external IDs indexed by dense ID
+        """
+        return np.concatenate(self.external) if self.external else np.zeros(0)
+
+
+class _Growing(object):
+    """
+        An array that is appended to in chunks, doubling its capacity as needed.
+    """
+    def __init__(self, dtype, fill=0):
+        self.array = np.full(1024, fill, dtype=dtype)
+        self.fill = fill
+        self.size = 0
+
+    def reserve(self, size):
+        if size > len(self.array):
+            array = np.full(max(size, 2*len(self.array)), self.fill, dtype=self.array.dtype)
+            array[:self.size] = self.array[:self.size]
+            self.array = array
+        self.size = max(self.size, size)
+
+    def append(self, values):
+        start = self.size
+        self.reserve(start + len(values))
+        self.array[start:self.size] = values
+
+    def values(self):
+        return self.array[:self.size]
+
+    def widen(self, dtype):
+        self.array = self.array.astype(dtype)
+
+
+def report_progress(file=None):
+    """
+        Creates a progress callback that prints the rows read and the throughput.
+        @params:
+            file[=None]: where to print (=sys.stderr)
+    """
+    def progress(stats):
+        done = ' (%.1f%%)' % (100.0*stats["bytes"]/stats["total_bytes"]) if stats["total_bytes"] else ''
+        (file or sys.stderr).write('%d rows, %d individuals%s in %.1fs, %.0f rows/s\n' % (stats["rows"],
+            stats["individuals"], done, stats["elapsed"], stats["rows_per_second"]))
+    return progress
+
+
+def _opened(f):
+    """
+        returns (binary file, should_close) for a path or an already open file
+    """
+    if isinstance(f, (str, bytes, os.PathLike)):
+        return open(f, 'rb'), True
+    return f, False
+
+
+class _Prepended(object):
+    """
+        A file that first gives back a line already read from it.
+    """
+    def __init__(self, first, f):
+        self.first = first
+        self.f = f
+
+    def read(self, size=-1):
+        if not self.first:
+            return self.f.read(size)
+        if size is None or size < 0:
+            data, self.first = self.first + self.f.read(), b''
+            return data
+        data, self.first = self.first[:size], self.first[size:]
+        return data
+
+
+def _csv_chunks(f, chunk_rows, columns, header, numeric_ids):
+    """
+        Yields every chunk of a CSV file parsed by pandas as a dict of column name to values,
+        and the number of bytes read so far. The classes (and the IDs if numeric_ids is False)
+        are read as pandas Categoricals, so no Python object is made per row.
+        The column names are the header's unless columns are given.
+    """
+    import pandas as pd
+
+    first = f.readline()
+    fields = [ name.strip() for name in first.decode().strip().split(',') ] if first.strip() else []
+    if header:
+        names = list(columns) if columns is not None else fields
+    else:
+        names = list(columns) if columns is not None else COLUMNS[:len(fields)]
+        f = _Prepended(first, f)
+    if 'source' not in names or 'target' not in names:
+        raise ValueError('The edge list needs source and target columns, found '+','.join(names)+'. Pass the names in columns.')
+
+    dtype = { "class": "category", "strength": np.float32 }
+    if numeric_ids is False:
+        dtype.update(source="category", target="category")
+    dtype = { name: dtype[name] for name in names if name in dtype }
+    tell = getattr(f, 'tell', None) or getattr(getattr(f, 'f', None), 'tell', None)
+    for frame in pd.read_csv(f, header=None, names=names, dtype=dtype, chunksize=chunk_rows, skipinitialspace=True):
+        chunk = { name: frame[name].array if isinstance(frame[name].dtype, pd.CategoricalDtype) else frame[name].to_numpy()
+            for name in names }
+        yield chunk, tell() if tell is not None else None
+    #endfor
+
+
+def _csv_ids(source, target, numeric_ids):
+    """
+        returns the IDs of the sources followed by the targets of a CSV chunk, as integers
+        or as a pandas Categorical of strings, and if the IDs are numeric.
+        By default the first chunk decides.
+    """
+    import pandas as pd
+
+    numeric = all(not isinstance(values, pd.Categorical) and values.dtype.kind in 'iu' for values in (source, target))
+    if numeric_ids is None:
+        numeric_ids = numeric
+    if numeric_ids:
+        if not numeric:
+            raise ValueError('Found an ID that is not an integer, pass numeric_ids=False to read the IDs as strings.')
+        return np.concatenate((source, target)).astype(np.int64), True
+    categoricals = [ values if isinstance(values, pd.Categorical) else pd.Categorical(np.asarray(values).astype(str))
+        for values in (source, target) ]
+    return pd.api.types.union_categoricals(categoricals), False
+
+
+def _remap(ids, values):
+    """
+        IdMap.remap of an array, or of a pandas Categorical whose labels are only remapped once.
+    """
+    if not hasattr(values, 'codes'):
+        return ids.remap(values)
+    codes = np.asarray(values.codes, dtype=np.int64)
+    present, first = np.unique(codes, return_index=True)
+    present = present[np.argsort(first, kind='stable')]
+    dense = np.zeros(len(values.categories), dtype=np.int64)
+    dense[present] = ids.remap(np.asarray(values.categories.astype(str))[present])
+    return dense[codes]
+
+
+def _binary_chunks(f, dtype, chunk_rows):
+    """
+        Yields the records of a binary file (raw records of dtype, or a .npy file when
+        dtype is None) chunk by chunk, and the number of bytes read so far.
+        Only the header of a .npy file is parsed, its records are streamed like raw ones.
+    """
+    f, should_close = _opened(f)
+    try:
+        count = None
+        if dtype is None:
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+            elif version == (2, 0):
+                shape, _, dtype = np.lib.format.read_array_header_2_0(f)
+            else:
+                raise ValueError('Unsupported .npy format version '+str(version))
+            count = shape[0] if len(shape) else 1
+        dtype = np.dtype(dtype)
+        read = 0
+        while count is None or count > 0:
+            rows = chunk_rows if count is None else min(chunk_rows, count)
+            chunk = np.frombuffer(f.read(rows*dtype.itemsize), dtype=dtype)
+            if len(chunk) == 0:
+                break
+            read += chunk.nbytes
+            if count is not None:
+                count -= len(chunk)
+            yield chunk, read
+        #endwhile
+    finally:
+        if should_close:
+            f.close()
+
+
+def read_edge_list(f,
+    format='CSV',
+    columns=None,
+    header=True,
+    dtype=None,
+    symmetric=False,
+    states=[0,1],
+    transmission_rate=1,
+    recovery_time=4,
+    numeric_ids=None,
+    progress=None,
+    chunk_size=None):
+    """
+        Builds a Model from an edge list file, streamed in chunks so the file is never held
+        in memory. External IDs are remapped to dense integer IDs and every individual is put
+        in the partition of the class column of its edges.
+        @params:
+            f: a path or a binary file handle
+            format[='CSV']: 'CSV' for source,target(,strength,class,state) rows like Model.edge_list,
+                    parsed with pandas.
+                    'BINARY' for records with source, target (and optional strength, class, state) fields,
+                    either raw records of dtype or a .npy file of them when dtype is None
+            columns[=None]: the names of the CSV columns, source and target are required.
+                    By default the names in the header, or the first ones of COLUMNS without a header.
+            header[=True]: if the CSV file starts with a header line
+            dtype[=None]: the numpy record dtype of a raw binary file,
+                    eg: [('source','<i8'), ('target','<i8'), ('strength','<f4'), ('class','<i2')]
+            symmetric[=False]: if every contact is only listed once and must be added in both directions
+            states[=[0,1]]: the states of the model
+            transmission_rate[=1]: the transmission rate of the model
+            recovery_time[=4]: the recovery time of the model
+            numeric_ids[=None]: if the CSV IDs are integers, by default they are if the ones of the first chunk are.
+                    Integer IDs are remapped much faster, but eg: "012" and "12" are the same ID.
+            progress[=None]: function called after every chunk with a dict of rows, bytes,
+                    total_bytes (None if unknown), individuals, elapsed and rows_per_second,
+                    eg: report_progress()
+            chunk_size[=CHUNK_ROWS]: rows (CSV) or records (binary) read at a time
+        returns (model, external_ids) where external_ids[i] is the ID individual i had in the file.
+        The state column, if any, sets the state of the source of each edge, and the
+        individuals in state 1 are the model's infecteds.
+        Individuals that are never a source are put in an unnamed partition.
+    """
+    try:
+        total_bytes = os.path.getsize(f) if isinstance(f, (str, bytes, os.PathLike)) else None
+    except OSError:
+        total_bytes = None
+    if format == 'CSV':
+        handle, should_close = _opened(f)
+        chunks = _csv_chunks(handle, chunk_size or CHUNK_ROWS, columns, header, numeric_ids)
+        field = lambda chunk, name: chunk.get(name)
+    elif format == 'BINARY':
+        should_close = False
+        chunks = _binary_chunks(f, dtype, chunk_size or CHUNK_ROWS)
+        field = lambda chunk, name: chunk[name] if name in chunk.dtype.names else None
+    else:
+        raise ValueError('Unknown edge list format '+repr(format))
+
+    ids = IdMap()
+    classes = IdMap()
+    sources, targets, weights = _Growing(np.int32), _Growing(np.int32), _Growing(np.float32)
+    partition_codes = _Growing(np.int32, fill=-1)
+    state = _Growing(np.int8, fill=states[0])
+    rows = 0
+    started = timer()
+    try:
+        for chunk, read in chunks:
+            # source and target IDs are remapped together so both see the same map
+            num_rows = len(field(chunk, 'source'))
+            if format == 'CSV':
+                ends, numeric_ids = _csv_ids(field(chunk, 'source'), field(chunk, 'target'), numeric_ids)
+            else:
+                ends = np.concatenate((field(chunk, 'source'), field(chunk, 'target')))
+            ends = _remap(ids, ends)
+            chunk_sources, chunk_targets = ends[:num_rows], ends[num_rows:]
+            if len(ids) >= 2**31 and sources.array.dtype != np.int64:
+                sources.widen(np.int64)
+                targets.widen(np.int64)
+            sources.append(chunk_sources)
+            targets.append(chunk_targets)
+            strength = field(chunk, 'strength')
+            weights.append(np.ones(num_rows, dtype=np.float32) if strength is None else strength.astype(np.float32))
+
+            partition_codes.reserve(len(ids))
+            state.reserve(len(ids))
+            chunk_classes = field(chunk, 'class')
+            if chunk_classes is not None:
+                partition_codes.array[chunk_sources] = _remap(classes, chunk_classes)
+            chunk_states = field(chunk, 'state')
+            if chunk_states is not None:
+                state.array[chunk_sources] = chunk_states.astype(np.int8)
+
+            rows += num_rows
+            if progress is not None:
+                elapsed = timer() - started
+                progress({ "rows": rows, "bytes": read, "total_bytes": total_bytes, "individuals": len(ids),
+                    "elapsed": elapsed, "rows_per_second": rows / elapsed if elapsed > 0 else 0.0 })
+        #endfor
+    finally:
+        if should_close:
+            handle.close()
+
+    num_individuals = len(ids)
+    partition_names = [ c.decode() if isinstance(c, bytes) else str(c) for c in classes.ids().tolist() ]
+    codes = partition_codes.values()[:num_individuals]
+    if not len(partition_names) or (codes < 0).any():
+        codes = np.where(codes < 0, len(partition_names), codes)
+        partition_names.append('')
+
+    sources, targets, weights = sources.values(), targets.values(), weights.values()
+    mirrors = None
+    if symmetric:
+        mirrors = Model._mirrors(len(sources))
+        sources, targets, weights = np.concatenate((sources, targets)), np.concatenate((targets, sources)), np.concatenate((weights, weights))
+
+    model = Model(transmission_rate, recovery_time, states=states)
+    model.set_graph(ContactGraph.from_edges(num_individuals, sources, targets, weights,
+        partition_codes=codes, partition_names=partition_names, mirrors=mirrors))
+    model.state = state.values()[:num_individuals].copy()
+    model.recount()
+    # the infecteds of the file are infectious from the first day
+    model.infecteds = np.flatnonzero(model.state == 1)
+    model.schedule_recoveries(model.infecteds, model.total_time + 1)
+
+    external = ids.ids()
+    return model, external.astype(str) if external.dtype.kind == 'S' else external
@@ -0,0 +1,128 @@
+import numpy as np
+
+
+class Intervention(object):
+    def __init__(self, trigger, action, repeat=False, name=None):
+        """
+            A change to a model that Model.simulate applies inside its day loop once a trigger fires.
+            eg: Intervention(prevalence_above(200), delete_edges(2, cross_partition), name='announcement')
+            @params:
+                trigger: function(model) checked at the end of every day, eg: on_day(10)
+                action: function(model) that changes the model in place, eg: scale_transmission_rate(0.5)
+                repeat[=False]: applies the action on every day the trigger holds instead of only the first
+                name[=None]: the name reported to the observers, which also keys the days it fired on
+                        in model.interventions_fired (=the name of the action). It must be unique in a schedule.
+        """
+        self.trigger = trigger
+        self.action = action
+        self.repeat = repeat
+        self.name = name or getattr(action, '__name__', 'intervention')
+
+    def fired(self, model):
+        """
+            returns the total_time of every day it was applied on to model (or to the model it was forked from).
+            The days are kept on the model under the name, so the same schedule can be
+            passed to every fork, and a run split over several simulate calls or resumed
+            from a checkpoint does not fire it again.
+        """
+        return model.interventions_fired.get(self.name, [])
+
+    def apply(self, model):
+        """
+            Applies the action if the trigger fires.
+            returns True if it was applied.
+        """
+        fired = self.fired(model)
+        if fired and not self.repeat:
+            return False
+        if not self.trigger(model):
+            return False
+        self.action(model)
+        model.interventions_fired[self.name] = fired + [model.total_time]
+        return True
+
+
+# triggers
+
+def on_day(day):
+    """
+        Fires at the end of day (model.total_time), or of the first day after it.
+    """
+    def trigger(model):
+        return model.total_time >= day
+    return trigger
+
+
+def prevalence_above(threshold, state=1):
+    """
+        Fires once more than threshold individuals are in a state (infected by default,
+        including the ones waiting in the weekend backlog).
+        @params:
+            threshold: a number of individuals, or a fraction of the population if below 1
+            state[=1]: the state to count
+    """
+    def trigger(model):
+        count = model.counts[:, state].sum()
+        return count > (threshold * model.graph.num_individuals if threshold < 1 else threshold)
+    return trigger
+
+
+def partition_above(partition, threshold, state=1):
+    """
+        Fires once more than threshold individuals of a partition are in a state.
+        @params:
+            partition: the name of the partition, eg: "SCI,1"
+            threshold: a number of individuals, or a fraction of the partition if below 1
+            state[=1]: the state to count
+    """
+    def trigger(model):
+        code = model.graph.partition_names.index(partition)
+        if threshold < 1:
+            return model.counts[code, state] > threshold * model.counts[code].sum()
+        return model.counts[code, state] > threshold
+    return trigger
+
+
+# actions
+
+def delete_edges(num_edges, predicate=None):
+    """
+        Deletes edges like Model.delete_edges, eg: delete_edges(2, cross_partition)
+        for the campus announcement of delete_preferential_edges.
+    """
+    def action(model):
+        model.delete_edges(num_edges, predicate=predicate)
+    action.__name__ = 'delete_edges'
+    return action
+
+
+def set_transmission_rate(transmission_rate):
+    """
+        Sets the transmission rate of the model.
+    """
+    def action(model):
+        model.transmission_rate = transmission_rate
+    action.__name__ = 'set_transmission_rate'
+    return action
+
+
+def scale_transmission_rate(factor):
+    """
+        Multiplies the transmission rate of the model by factor, eg: 0.5 for masks.
+    """
+    def action(model):
+        model.transmission_rate *= factor
+    action.__name__ = 'scale_transmission_rate'
+    return action
+
+
+def isolate_infecteds(include_backlog=True):
+    """
+        Removes every edge of the individuals infected now, see Model.isolate.
+        @params:
+            include_backlog[=True]: also isolates the infecteds waiting in the weekend backlog
+    """
+    def action(model):
+        model.isolate(np.concatenate([model.infecteds] + (model.backlog if include_backlog else [])))
+    action.__name__ = 'isolate_infecteds'
+    return action
@@ -1,70 +1,207 @@
 import numpy as np
+import copy
+import inspect
+import math
+from functools import lru_cache
+from timeit import default_timer as timer
 from collections import Counter
-from BaseObjects import Individual
-import random
-
-# np.random.seed(1)
+from BaseObjects import IndividualList, ContactGraph
 
 class Model(object):
-    def __init__(self, transmission_rate, recovery_time, states=[0,1]):
+    def __init__(self, transmission_rate, recovery_time, states=[0,1], seed=1):
         """
             Creates a model
+            @params:
+                seed[=1]: seed (or np.random.Generator) of this model's own random stream
         """
-        np.random.seed(1)
+        self.rng = np.random.default_rng(seed)
         self.transmission_rate = transmission_rate
         self.recovery_time = recovery_time
         self.states = states
-        self.infecteds = []
-        self.individuals = []
+        self.infecteds = np.zeros(0, dtype=np.int64)
+        self.graph = None
+        self.removed_edges = None # boolean overlay of the graph's deleted edges, shared until written
+        self.state = np.zeros(0, dtype=np.int8)
+        self.time_since_infected = np.zeros(0, dtype=np.int32)
+        self.recovery_day = np.zeros(0, dtype=np.int32) # the step each infected is due to recover on, -1 if unknown
+        self.recovery_calendar = {} # step -> list of arrays of individuals due to recover on it
+        self.backlog = [] # arrays of infecteds waiting for the weekend to end before they are infectious
+        self.counts = np.zeros((0, max(len(states), 3)), dtype=np.int64) # individuals per (partition, state)
+        self.partition_curves = None
+        self.interventions_fired = {} # intervention name -> the total_time of every day it fired on
         self.total_time = 0
 
-    def deep_copy(self):
-
-        new_model = Model(self.transmission_rate, self.recovery_time, states=self.states)
-        new_model.infecteds = list(self.infecteds)
-        new_model.individuals = []
-        for individual in self.individuals:
-            new_model.individuals.append(
-                Individual(
-                    individual.id, 
-                    individual.state, 
-                    [ (k,v) for k,v in individual.friends], 
-                    individual.properties, 
-                    individual.time_since_infected))
-        new_model.partitioning = dict(self.partitioning)
-        new_model.total_time = self.total_time
+    def set_graph(self, graph):
+        """
+            Attaches a ContactGraph to this model and resets every individual
+            to the default state.
+        """
+        self.graph = graph
+        self.removed_edges = None
+        self.state = np.full(graph.num_individuals, self.states[0], dtype=np.int8)
+        self.time_since_infected = np.zeros(graph.num_individuals, dtype=np.int32)
+        self.recovery_day = np.full(graph.num_individuals, -1, dtype=np.int32)
+        self.recovery_calendar = {}
+        self.backlog = []
+        self.recount()
+
+    def recount(self):
+        """
+            Recomputes the number of individuals in each (partition, state) from scratch.
+            Only needed after editing self.state directly, the simulation keeps them up to date.
+        """
+        num_partitions = len(self.graph.partition_names)
+        num_states = max(len(self.states), 3, int(self.state.max()) + 1 if len(self.state) else 0)
+        self.counts = np.bincount(self.graph.partition_codes.astype(np.int64)*num_states + self.state,
+            minlength=num_partitions*num_states).reshape(num_partitions, num_states)
+
+    def _transition(self, individuals, old_state, new_state):
+        """
+            Moves individuals (all in old_state) to new_state and updates the counts.
+        """
+        self.state[individuals] = new_state
+        moved = np.bincount(self.graph.partition_codes[individuals], minlength=len(self.counts))
+        self.counts[:, old_state] -= moved
+        self.counts[:, new_state] += moved
+
+    @property
+    def individuals(self):
+        """
+            Individual views over the network (kept for backwards compatibility)
+        """
+        return IndividualList(self)
+
+    @individuals.setter
+    def individuals(self, individuals):
+        individuals = list(individuals)
+        self.set_graph(ContactGraph.from_individuals(individuals))
+        self.state[:] = [ i.state for i in individuals ]
+        self.time_since_infected[:] = [ i.time_since_infected for i in individuals ]
+        self.recount()
+
+    @property
+    def partitioning(self):
+        """
+            dict of partition name to the IDs of the individuals in it
+        """
+        order = np.argsort(self.graph.partition_codes, kind='stable')
+        bounds = np.cumsum(np.bincount(self.graph.partition_codes, minlength=len(self.graph.partition_names)))
+        return { name: order[(bounds[c-1] if c else 0):bounds[c]] for c, name in enumerate(self.graph.partition_names) }
+
+    def fork(self, seed=None):
+        """
+            Branches this model into a new model that shares the (immutable) ContactGraph
+            and the removed edge overlay, and only copies the per-individual state.
+            Edge deletions on either model replace their own overlay, so branches never see
+            each other's edits. The fork draws from an independent child of
+            this model's random stream unless a seed is given.
+        """
+        new_model = copy.copy(self)
+        new_model.rng = np.random.default_rng(self.rng.spawn(1)[0] if seed is None else seed)
+        new_model.infecteds = self.infecteds.copy()
+        new_model.state = self.state.copy()
+        new_model.time_since_infected = self.time_since_infected.copy()
+        new_model.recovery_day = self.recovery_day.copy()
+        new_model.recovery_calendar = { step: list(due) for step, due in self.recovery_calendar.items() }
+        new_model.backlog = list(self.backlog)
+        new_model.counts = self.counts.copy()
+        new_model.partition_curves = None
+        new_model.interventions_fired = dict(self.interventions_fired)
+        return new_model
+
+    def deep_copy(self, seed=None):
+        """
+            Copies this model, including its ContactGraph.
+        """
+        new_model = self.fork(seed=seed)
+        new_model.graph = self.graph.copy()
+        if self.removed_edges is not None:
+            new_model.removed_edges = self.removed_edges.copy()
         return new_model
 
+    def active_edges(self, individuals):
+        """
+            Gathers the edges of the given individuals that have not been removed.
+            returns the (positions, owners) arrays with the position of every edge in the
+            graph and the index into individuals of the individual that owns it.
+        """
+        positions = self.graph.edge_positions(individuals)
+        owners = np.repeat(np.arange(len(individuals)), self.graph.indptr[np.asarray(individuals)+1] - self.graph.indptr[individuals])
+        if self.removed_edges is not None:
+            kept = ~self.removed_edges[positions]
+            positions, owners = positions[kept], owners[kept]
+        return positions, owners
+
+    def edges(self):
+        """
+            returns the (sources, targets, weights) arrays of every edge that has not been removed
+        """
+        sources, targets, weights = self.graph.edge_sources(), self.graph.indices, self.graph.weights
+        if self.removed_edges is not None:
+            kept = ~self.removed_edges
+            sources, targets, weights = sources[kept], targets[kept], weights[kept]
+        return sources, targets, weights
+
+    def add_edges(self, sources, targets, weights=None):
+        """
+            Adds directed edges to the network. The ContactGraph is immutable, so it is rebuilt
+            from every edge that has not been removed plus the new ones, and the overlay is dropped
+            like in compact. Other forks keep the old graph.
+            @params:
+                sources: the ID of the individual that owns each new edge
+                targets: the ID of the friend of each new edge
+                weights[=None]: the contact strength of each new edge (=1)
+        """
+        old_sources, old_targets, old_weights = self.edges()
+        weights = np.ones(len(sources), dtype=np.float32) if weights is None else weights
+        self.graph = ContactGraph.from_edges(self.graph.num_individuals,
+            np.concatenate((old_sources, np.asarray(sources, dtype=old_sources.dtype))),
+            np.concatenate((old_targets, np.asarray(targets, dtype=old_targets.dtype))),
+            np.concatenate((old_weights, np.asarray(weights, dtype=np.float32))),
+            partition_codes=self.graph.partition_codes,
+            partition_names=self.graph.partition_names)
+        self.removed_edges = None
+
+    def compact(self):
+        """
+            Rebuilds the ContactGraph without the removed edges and drops the overlay.
+        """
+        if self.removed_edges is not None:
+            self.graph = self.graph.remove_edges(self.removed_edges)
+            self.removed_edges = None
+
     @staticmethod
     def random_network(num_individuals,
         poisson_parameter, 
         partitioning, 
         states=[0,1],
         transmission_rate=1,
-        recovery_time=4):
+        recovery_time=4,
+        seed=1):
         """
             Creates a random poisson network of individuals
             @params:
                 num_individuals: the number of individuals in the network
                 poisson_parameter: the avergage number of connections
                 states[=0,1]: the possible states of the network
+                seed[=1]: seed (or np.random.Generator) of the model's random stream
         """
-        model = Model(transmission_rate, recovery_time, states=states)
-        model.partitioning = { p:[] for p in partitioning}
-        # create all the new individuals        
-        model.individuals = map(lambda i: Individual(i, properties=np.random.choice(partitioning), state=states[0]), xrange(num_individuals))
+        model = Model(transmission_rate, recovery_time, states=states, seed=seed)
+        # assign every individual to a partition
+        partition_codes = model.rng.integers(len(partitioning), size=num_individuals)
 
-        # loop to generate add friends to individuals
-        for individual in model.individuals:
-            
-            k = np.random.poisson(poisson_parameter) # number of connections
+        # every individual makes k ~ poisson connections to uniformly chosen friends
+        k = model.rng.poisson(poisson_parameter, size=num_individuals)
+        sources = np.repeat(np.arange(num_individuals), k)
+        targets = model.rng.integers(num_individuals, size=len(sources))
 
-            for fid in np.random.randint(num_individuals, size=k):
-                # add the connections between the two
-                individual.add_connection(fid)
-                model.individuals[fid].add_connection(individual.id)
-            #endfor friends
-        #endfor over all individuals
+        # add the connections in both directions
+        model.set_graph(ContactGraph.from_edges(num_individuals,
+            np.concatenate((sources, targets)),
+            np.concatenate((targets, sources)),
+            partition_codes=partition_codes,
+            partition_names=partitioning,
+            mirrors=Model._mirrors(len(sources))))
 
         return model
 
@@ -76,16 +213,20 @@ class Model(object):
         states=[0,1], 
         symmetric=True,
         transmission_rate=1,
-        recovery_time=4):
+        recovery_time=4,
+        seed=1,
+        verbose=False):
         """
             Creates a Network of individuals
             @params:
                 num_individuals: the number of individuals in this network
                 num_connections: the average number of connections in this network OR
                         a dict with the average number of connections for each partitioning.
-                        note that the number can be a function that returns an integer.
+                        note that the number can be a function of the model's np.random.Generator that returns an integer.
                         eg: {"MALE,1": 5, "FEMALE,1":6, ... }
-                        OR {"MALE,1": lambda : np.random.poisson(5) }
+                        OR {"MALE,1": lambda rng: rng.poisson(5) }
+                        functions without arguments, eg: lambda : np.random.poisson(5), are run with
+                        np.random seeded from the model's stream, and its global state is restored afterwards.
                 partitioning: describes how the individuals should be partitioned. 
                         Must be a dictionary whose keys are comma separated according to characteristics.
                         (!) entries must add to 1
@@ -99,106 +240,217 @@ class Model(object):
                 symmetric: if True it implies that if X is friends with Y, it automatically implies that Y is friends with X
                 transmission_rate: the probability that a contact would result in a transmission
                 recovery_time: the time taken to recover from the infected state into the recovered state.
+                seed: seed (or np.random.Generator) of the model's random stream (=1)
+                verbose: prints the progress of the build (=False)
                 # (!) contact strenghts not yet supported.
         """
-        assert np.sum(partitioning.values()) == 1, 'Partitioning must add to 1. Instead added to: '+str(np.sum(partitioning.values()))
+        assert np.isclose(np.sum(list(partitioning.values())), 1), 'Partitioning must add to 1. Instead added to: '+str(np.sum(list(partitioning.values())))
         assert len(states) >= 1, 'Must have at least 1 state'
         assert type(num_connections) in [int, dict], 'number of connections is of unknown type.'
 
-        model = Model(transmission_rate, recovery_time, states=states)
-
-        # create a partitioning for easy access later.
-        model.partitioning = { key: [] for key in partitioning.keys() }
-        model.individuals = []
-        model.infecteds = []
-
+        model = Model(transmission_rate, recovery_time, states=states, seed=seed)
 
-        #create our individuals
-        for i in range(num_individuals):
-            
-            unif = np.random.random() #generate a uniform variable
-            #determine the partition of this individual:
+        partition_names = list(partitioning.keys())
+        probabilities = np.array(list(partitioning.values()), dtype=float)
 
-            prev_prob = 0 
-            selected_key = ""
-            for key, prob in partitioning.items():
-                # just checks if a uniform is in a certain length
-                if unif <= prev_prob+prob and unif > prev_prob:
-                    selected_key = key
-                    break
-                else:
-                    prev_prob += prob
-            
-            created_individual = Individual(i, properties=selected_key, state=states[0])
-            
-            model.individuals.append(created_individual)
-            model.partitioning[selected_key].append(created_individual)
-        print('Created '+str(num_individuals)+' individuals. Now creating network')
+        #create our individuals, each one is assigned to a partition in a single draw
+        partition_codes = model.rng.choice(len(partition_names), size=num_individuals, p=probabilities/probabilities.sum())
+        if verbose:
+            print('Created '+str(num_individuals)+' individuals. Now creating network')
         # format the connections variable properly. 
         if type(num_connections) is int:
             num_connections = { key: num_connections for key in partitioning.keys()}
-        
-        # calculate the total number of connections in this network
-        total_num_connections = 0
+
+        # draw the number of connections each individual is after
+        degree_targets = np.zeros(num_individuals, dtype=np.int64)
+        global_state = None
         try:
-            for k,v in model.partition_summary():
+            for code, key in enumerate(partition_names):
+                members = np.flatnonzero(partition_codes == code)
                 # check if the number is actualy a number or a function.
-                total_num_connections += num_connections[k]() * v if hasattr(num_connections[k], '__call__') else num_connections[k] * v
+                if hasattr(num_connections[key], '__call__'):
+                    draw = num_connections[key]
+                    if _takes_argument(draw):
+                        values = (draw(model.rng) for _ in members)
+                    else:
+                        if global_state is None:
+                            # the legacy functions draw from np.random, seeded so the build is reproducible
+                            global_state = np.random.get_state()
+                            np.random.seed(int(model.rng.integers(2**32)))
+                        values = (draw() for _ in members)
+                    degree_targets[members] = np.fromiter(values, dtype=np.int64, count=len(members))
+                else:
+                    degree_targets[members] = num_connections[key]
         except KeyError as e:
             raise Exception("A key wasn't specified in num_connections: "+ str(e))
-            
-        print('Number of connections: '+str(total_num_connections)+'. Now creating...')
-        # create some connections
-        j = 0
-        while j < total_num_connections:
-            if j % 5000 == 0:
-                print('Created '+str(j)+' connections')
-            if j > total_num_connections * 5:
-                raise Exception("Made too many connection attempts")
-            j+=1 #increment
-            # pick two random individuals from the population
-            individual_1 = model.individuals[np.random.randint(num_individuals)]
-            individual_2 = model.individuals[np.random.randint(num_individuals)]
-            if individual_1.id == individual_2.id: #make sure they are not the same
-                continue
-            
-            # determine the average number of connections for this individual:
-            k = individual_1.properties # the property
-            avg_num_connections = num_connections[k]() if hasattr(num_connections[k], '__call__') else num_connections[k] 
-
-            if len(individual_1.friends) < avg_num_connections:
-                # only add a new friend if the current num of connections is less than the avg.
-
-                # get the probabilitiy of such a pair being friends.
-                try:
-                    prob_of_friendship = friend_distribution[(individual_1.properties, individual_2.properties)]
-                except KeyError as e: # could not find the pair, try the reverse if symmetrical.
-                    if symmetric:
-                        prob_of_friendship = friend_distribution[(individual_2.properties, individual_1.properties)]
-                    else:
-                        raise KeyError('Could not find pair friendship probability.')
-
-                # determine if the friend pair will exist
-                unif = np.random.random()
-                if unif < prob_of_friendship:
-                    individual_1.add_connection(individual_2.id)
-                    if symmetric:
-                        individual_2.add_connection(individual_1.id)
-                    #endif symmetric
-                #endif unif
-            #endif avg
-        #endwhile
-        
+        finally:
+            if global_state is not None:
+                np.random.set_state(global_state)
+
+        # get the probabilitiy of each pair of partitions being friends.
+        friendship = np.zeros((len(partition_names), len(partition_names)))
+        for a, properties_1 in enumerate(partition_names):
+            for b, properties_2 in enumerate(partition_names):
+                if (properties_1, properties_2) in friend_distribution:
+                    friendship[a,b] = friend_distribution[(properties_1, properties_2)]
+                elif symmetric and (properties_2, properties_1) in friend_distribution:
+                    # could not find the pair, try the reverse if symmetrical.
+                    friendship[a,b] = friend_distribution[(properties_2, properties_1)]
+                else:
+                    raise KeyError('Could not find pair friendship probability for '+str((properties_1, properties_2)))
+
+        if verbose:
+            print('Number of connections: '+str(degree_targets.sum())+'. Now creating...')
+        sources, targets = Model._block_edges(partition_codes, degree_targets, friendship, model.rng)
+        mirrors = None
+        if symmetric:
+            mirrors = Model._mirrors(len(sources))
+            sources, targets = np.concatenate((sources, targets)), np.concatenate((targets, sources))
+
+        model.set_graph(ContactGraph.from_edges(num_individuals,
+            sources,
+            targets,
+            partition_codes=partition_codes,
+            partition_names=partition_names,
+            mirrors=mirrors))
+
         return model
 
-    def partition_summary(self, detailed=False):
+    @staticmethod
+    def _mirrors(num_connections):
+        """
+            returns the mirror indices of num_connections edges followed by their reverses
+        """
+        return np.concatenate((np.arange(num_connections, 2*num_connections), np.arange(num_connections)))
+
+    @staticmethod
+    def _block_edges(partition_codes, degree_targets, friendship, rng):
+        """
+            Samples the edges of a stochastic block model.
+            Every individual makes degree_targets attempts at a friendship with a
+            uniformly chosen individual, which succeeds with the friendship probability
+            of their two partitions. The number of successes of each pair of partitions
+            is drawn as a single multinomial, and they are handed out to the attempts
+            of the source partition without replacement so that nobody exceeds their target.
+            @params:
+                partition_codes: the partition of each individual
+                degree_targets: the number of attempts of each individual
+                friendship: matrix with the probability of friendship between two partitions
+                rng: the np.random.Generator to draw from
+            returns the (sources, targets) arrays of the directed edges.
         """
+        num_individuals = len(partition_codes)
+        num_partitions = friendship.shape[0]
+        order = np.argsort(partition_codes, kind='stable')
+        bounds = np.concatenate(([0], np.cumsum(np.bincount(partition_codes, minlength=num_partitions))))
+        members = [ order[bounds[a]:bounds[a+1]] for a in range(num_partitions) ]
+        sizes = np.diff(bounds)
 
+        sources = []
+        targets = []
+        for a in range(num_partitions):
+            attempts = np.repeat(members[a], degree_targets[members[a]])
+            if len(attempts) == 0:
+                continue
+            # a uniform partner lands in partition b and is accepted with friendship[a,b]
+            pair_probabilities = sizes / float(num_individuals) * friendship[a]
+            counts = rng.multinomial(len(attempts), np.append(pair_probabilities, max(0.0, 1 - pair_probabilities.sum())))[:-1]
+            attempts = attempts[rng.permutation(len(attempts))[:counts.sum()]]
+
+            for b, chunk in zip(range(num_partitions), np.split(attempts, np.cumsum(counts)[:-1])):
+                if len(chunk) == 0:
+                    continue
+                sources.append(chunk)
+                targets.append(members[b][rng.integers(sizes[b], size=len(chunk))])
+            #endfor b
+        #endfor a
+
+        if not sources:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        sources = np.concatenate(sources)
+        targets = np.concatenate(targets)
+        # individuals can not be friends with themselves
+        distinct = sources != targets
+        return sources[distinct], targets[distinct]
+
+    def partition_summary(self, detailed=False):
+        """
+            Summarizes the partitions of the network.
+            @params:
+                detailed[=False]: also returns the contact analytics of the network
+            returns a list of (partition, number of individuals), or if detailed a dict with:
+                partitions: the partition names, indexed by code
+                sizes: the number of individuals in each partition
+                mixing: the (partitions, partitions) contact mixing matrix, see mixing_matrix
+                density: mixing divided by the number of possible contacts of each pair of partitions,
+                        the chance that two given individuals of the partitions are friends
+                degrees: the (partitions, max degree+1) degree distribution of each partition, see degree_distributions
+                mean_degree: the mean number of contacts of the individuals of each partition
+                states: the (partitions, states) number of individuals in each state (self.counts)
+                state_mixing: the (states, states, partitions, partitions) mixing by state, eg: [1,0]
+                        are the contacts of the infecteds with susceptibles
         """ 
-        if detailed:
-            raise NotImplemented("Not Implemented Yet")
+        sizes = np.bincount(self.graph.partition_codes, minlength=len(self.graph.partition_names))
+        if not detailed:
+            return list(zip(self.graph.partition_names, sizes.tolist()))
+
+        state_mixing = self.mixing_matrix(by_state=True)
+        mixing = state_mixing.sum(axis=(0, 1))
+        degrees = self.degree_distributions()
+        possible = np.outer(sizes, sizes) - np.diag(sizes) # nobody is friends with themselves
+        with np.errstate(divide='ignore', invalid='ignore'):
+            density = np.where(possible > 0, mixing / np.maximum(possible, 1), 0.0)
+            mean_degree = np.where(sizes > 0, (degrees * np.arange(degrees.shape[1])).sum(axis=1) / np.maximum(sizes, 1), 0.0)
+        return {
+            "partitions": list(self.graph.partition_names),
+            "sizes": sizes,
+            "mixing": mixing,
+            "density": density,
+            "degrees": degrees,
+            "mean_degree": mean_degree,
+            "states": self.counts.copy(),
+            "state_mixing": state_mixing
+        }
+
+    def mixing_matrix(self, by_state=False, state=None):
+        """
+            Counts the contacts between every pair of partitions in a single pass over the
+            edges that have not been removed.
+            @params:
+                by_state[=False]: also splits the contacts by the state of both ends
+                state[=None]: the state of every individual to split by (=self.state),
+                        eg: the state of a checkpoint to get the mixing at that time
+            returns a (partitions, partitions) array whose [a,b] entry is the number of edges from
+            partition a to partition b (a symmetric friendship counts as a->b and b->a),
+            or if by_state a (states, states, partitions, partitions) array whose [x,y,a,b] entry
+            counts the edges from individuals of partition a in state x to partition b in state y.
+        """
+        codes = self.graph.partition_codes
+        num_partitions = len(self.graph.partition_names)
+        sources, targets, _ = self.edges()
+        pairs = codes[sources].astype(np.int64)*num_partitions + codes[targets]
+        if not by_state:
+            return np.bincount(pairs, minlength=num_partitions**2).reshape(num_partitions, num_partitions)
+
+        state = self.state if state is None else np.asarray(state)
+        num_states = max(self.counts.shape[1], int(state.max()) + 1 if len(state) else 0)
+        pairs += (state[sources].astype(np.int64)*num_states + state[targets]) * num_partitions**2
+        return np.bincount(pairs, minlength=(num_states*num_partitions)**2).reshape(num_states, num_states, num_partitions, num_partitions)
+
+    def degree_distributions(self):
+        """
+            Counts the contacts (edges that have not been removed) of every individual by partition.
+            returns a (partitions, max degree+1) array whose [a,k] entry is the number of
+            individuals of partition a with k contacts.
+        """
+        codes = self.graph.partition_codes
+        num_partitions = len(self.graph.partition_names)
+        if self.removed_edges is None:
+            degree = self.graph.degree()
         else:
-            return map( lambda k: (k[0],len(k[1])), self.partitioning.items())
+            degree = np.bincount(self.edges()[0], minlength=self.graph.num_individuals)
+        width = int(degree.max()) + 1 if len(degree) else 1
+        return np.bincount(codes.astype(np.int64)*width + degree, minlength=num_partitions*width).reshape(num_partitions, width)
 
     def edge_list(self):
         """
@@ -206,32 +458,49 @@ class Model(object):
             source_id,target_id,strength,class,state
         """
         to_return = ['source,target,strength,class,state']
-        for i in self.individuals:
-
-            for fid,c in i.friends:
-                to_return.append(str(i.id)+','+str(fid)+','+str(c)+','+i.properties.replace(',','')+','+str(i.state))
+        classes = [ p.replace(',','') for p in self.graph.partition_names ]
+        codes = self.graph.partition_codes
+        for i, fid, c in zip(*[ a.tolist() for a in self.edges() ]):
+            to_return.append(str(i)+','+str(fid)+','+('%g' % c)+','+classes[codes[i]]+','+str(self.state[i]))
 
         return to_return
 
-    def export_network(self, format='JSON'):
-        if not 'JSON':
+    def export_network(self, format='JSON', file=None):
+        """
+            Exports the network.
+            @params:
+                format[='JSON']: 'JSON' for the d3 {"nodes", "links"} format, 'CSV' for the edge_list,
+                        'JSONL' for JSON-lines or 'NPZ' for a binary dump (only with file)
+                file[=None]: a path or file handle. If given the network is streamed
+                        to it in chunks (see Export) instead of being returned.
+        """
+        import Export
+        if format not in Export.WRITERS:
+            raise ValueError('Unknown export format '+repr(format)+', use one of '+', '.join(Export.WRITERS))
+        if file is not None:
+            Export.WRITERS[format](self, file)
+            return
+
+        if format == 'CSV':
             return self.edge_list()
+        if format != 'JSON':
+            raise ValueError('The '+format+' format can only be written to a file, pass file.')
 
         nodes = []
         links = []
-        for i in self.individuals:
+        for i, (code, state) in enumerate(zip(self.graph.partition_codes.tolist(), self.state.tolist())):
             nodes.append({
-                "name":i.id,
-                "group":i.properties,
-                "state":i.state
+                "name":i,
+                "group":self.graph.partition_names[code],
+                "state":state
                 })
 
-            for f,v in i.friends:
-                links.append({
-                    "source":i.id,
-                    "target":f,
-                    "value":v
-                    })
+        for i, f, v in zip(*[ a.tolist() for a in self.edges() ]):
+            links.append({
+                "source":i,
+                "target":f,
+                "value":v
+                })
 
         return {"links":links, "nodes":nodes}
 
@@ -239,123 +508,567 @@ class Model(object):
         """
             Turns an individual into an infected.
             @params:
-                id: the ID of the individual to make infected.
+                id: the ID of the individual to make infected (0 included).
                     By default this is random.
         """
-        infected_id = infected_id if infected_id else np.random.randint(len(self.individuals)) 
-        
-        if not self.infecteds:
-            self.infecteds = []
+        infected_id = infected_id if infected_id is not False else self.rng.integers(self.graph.num_individuals)
+
+        self._transition(np.array([infected_id]), self.state[infected_id], infected_state if infected_state else self.states[1])
+        self.infecteds = np.append(self.infecteds, infected_id)
+        self.schedule_recoveries(np.array([infected_id]), self.total_time + 1)
+
+    @staticmethod
+    def is_weekend(step):
+        """
+            returns True if people infected on this step (the value of total_time
+            once the step is done) wait in the weekend backlog.
+        """
+        return step % 6 == 0 or step % 5 == 0
+
+    @staticmethod
+    def release_step(step):
+        """
+            returns the step at the end of which people infected on this step join the infecteds
+        """
+        while Model.is_weekend(step):
+            step += 1
+        return step
+
+    def draw_recovery_times(self, size):
+        """
+            Draws size recovery thresholds poisson(recovery_time) + randint(5).
+            Under the 'hazard' rule an infected recovers on the first day its
+            time_since_infected is above that day's threshold.
+        """
+        return self.rng.poisson(self.recovery_time, size=size) + self.rng.integers(5, size=size)
+
+    def draw_recovery_ages(self, time_since_infected):
+        """
+            Draws, once, the time_since_infected each infected recovers at, with the same
+            distribution as the per-day draw_recovery_times rule, see recovery_ages.
+            @params:
+                time_since_infected: array of the current time_since_infected of the infecteds
+        """
+        return recovery_ages(self.recovery_time, time_since_infected, self.rng.random(len(time_since_infected)))
+
+    def schedule_recoveries(self, individuals, next_step):
+        """
+            Draws, once, the step on which each of the given infecteds recovers and
+            files them in the recovery calendar.
+            The step follows the distribution of the per-day rule ('hazard'), see draw_recovery_ages.
+            @params:
+                individuals: array of infected IDs
+                next_step: the first step on which they are infectious
+        """
+        if len(individuals) == 0:
+            return
+        tsi = self.time_since_infected[individuals]
+        days = next_step + np.maximum(self.draw_recovery_ages(tsi) - tsi, 0)
+        self.recovery_day[individuals] = days
+        Model._file_calendar(self.recovery_calendar, individuals, days)
+
+    @staticmethod
+    def _file_calendar(calendar, individuals, days):
+        """
+            Files individuals in a recovery calendar (step -> list of arrays of individuals)
+            under their recovery days, with one array per step.
+        """
+        order = np.argsort(days, kind='stable')
+        steps, starts = np.unique(days[order], return_index=True)
+        for step, due in zip(steps.tolist(), np.split(individuals[order], starts[1:])):
+            calendar.setdefault(step, []).append(due)
+
+    def rebuild_recovery_calendar(self):
+        """
+            Rebuilds the recovery calendar from recovery_day, eg: after loading a model.
+        """
+        self.recovery_calendar = {}
+        infected = np.flatnonzero((self.state == 1) & (self.recovery_day > self.total_time))
+        Model._file_calendar(self.recovery_calendar, infected, self.recovery_day[infected])
+
+    def _transmission_step(self, recovery='presampled', stats=None):
+        """
+            Runs one day of transmissions and recoveries for the current infecteds.
+            Every edge out of the infecteds to a susceptible friend is tried at once,
+            infecteds that recover are dropped from self.infecteds.
+            @params:
+                recovery[='presampled']: 'presampled' recovers the infecteds due today in the
+                        recovery calendar, 'hazard' redraws every infected's recovery time
+                stats[=None]: a dict to add the day's counters to (see simulate)
+            returns the array of newly infected IDs.
+        """
+        frontier = self.infecteds
+        step = self.total_time + 1
 
-        self.individuals[infected_id].state = infected_state if infected_state else self.states[1]
-        self.infecteds.append(infected_id)
+        # gather every edge out of the infecteds and keep the susceptible friends
+        friends = self.graph.indices[self.active_edges(frontier)[0]]
+        edges_examined = len(friends)
+        friends = friends[self.state[friends] == 0]
 
-    def simulate(self, time=100, printer=False, return_data=False, until=None):
+        # one bernoulli trial per contact, a friend reached twice is only infected once
+        newly_infected = np.unique(friends[self.rng.random(len(friends)) < self.transmission_rate])
+        self._transition(newly_infected, 0, 1)
+        self.time_since_infected[newly_infected] = 0
+
+        if recovery == 'hazard':
+            # infecteds recover once they pass a freshly drawn recovery time
+            recovery_times = self.draw_recovery_times(len(frontier))
+            recovered = self.time_since_infected[frontier] > recovery_times
+            self._transition(frontier[recovered], 1, 2)
+            self.infecteds = frontier[~recovered]
+            num_recovered, redrawn, draw_calls = int(recovered.sum()), len(frontier), 2
+        else:
+            # pop the infecteds due today, skipping anyone who recovered some other way
+            due = self.recovery_calendar.pop(step, [])
+            due = np.concatenate(due) if due else np.zeros(0, dtype=np.int64)
+            due = due[(self.state[due] == 1) & (self.recovery_day[due] == step)]
+            if len(due):
+                self._transition(due, 1, 2)
+                self.infecteds = frontier[self.state[frontier] == 1]
+            # the newly infected start being infectious after they are released
+            self.schedule_recoveries(newly_infected, Model.release_step(step) + 1)
+            num_recovered, redrawn, draw_calls = len(due), len(newly_infected), 1 if len(newly_infected) else 0
+        self.time_since_infected[self.infecteds] += 1
+
+        if stats is not None:
+            # one uniform per attempt, and two calls of size redrawn in draw_recovery_times
+            # or one in draw_recovery_ages
+            stats["edges_examined"] += edges_examined
+            stats["attempts"] += len(friends)
+            stats["infections"] += len(newly_infected)
+            stats["recoveries"] += num_recovered
+            stats["rng_calls"] += 1 + draw_calls
+            stats["random_draws"] += len(friends) + draw_calls*redrawn
+
+        return newly_infected
+
+    @staticmethod
+    def _check_interventions(interventions):
+        names = [ intervention.name for intervention in interventions ]
+        if len(set(names)) < len(names):
+            raise ValueError('Interventions must have distinct names, the days they fired on are kept under them: '+', '.join(names))
+
+    def _schedule_pending(self, recovery='presampled'):
+        """
+            Before a presampled run, draws a recovery day for the infecteds without a
+            pending one (eg: from a hazard run).
+        """
+        if recovery == 'hazard':
+            return
+        unscheduled = self.infecteds[self.recovery_day[self.infecteds] <= self.total_time]
+        self.schedule_recoveries(unscheduled, self.total_time + 1)
+        waiting = np.concatenate([np.zeros(0, dtype=np.int64)] + self.backlog)
+        unscheduled = waiting[self.recovery_day[waiting] <= self.total_time]
+        self.schedule_recoveries(unscheduled, Model.release_step(self.total_time + 1) + 1)
+
+    def _advance_day(self, recovery='presampled', stats=None):
+        """
+            Runs one day of the simulation and releases the new infecteds, unless
+            they have to wait in the weekend backlog.
+            returns the array of newly infected IDs.
+        """
+        stored_infecteds = self._transmission_step(recovery, stats)
+
+        self.total_time += 1
+        # people infected on the weekend only become infectious on the next weekday
+        if Model.is_weekend(self.total_time):
+            self.backlog.append(stored_infecteds)
+        else:
+            self.infecteds = np.concatenate([self.infecteds] + self.backlog + [stored_infecteds])
+            self.backlog = []
+        #endif
+        return stored_infecteds
+
+    def steps(self, time=None, recovery='presampled', partitions=False, newly_infected=False, interventions=None):
+        """
+            Runs the simulation as a generator that yields a snapshot at the end of every day,
+            so a run can be watched (or stopped) while it goes and nothing is accumulated.
+            eg: for snapshot in model.steps(): print(snapshot["num_infected"])
+            @params:
+                time[=None]: the number of days to simulate. By default it runs until
+                        nobody is infected or waiting in the backlog.
+                recovery[='presampled']: see simulate
+                partitions[=False]: adds the (partitions, states) counts of the day (a copy of self.counts)
+                newly_infected[=False]: adds the array of the IDs infected on the day
+                interventions[=None]: see simulate
+            yields a dict with:
+                day: the day of this run, step: total_time,
+                num_infected: the number of infecteds, backlog: the number waiting in the backlog,
+                states: the number of individuals in each state,
+                and partitions and newly_infected when asked for.
+        """
+        interventions = interventions or []
+        Model._check_interventions(interventions)
+        self._schedule_pending(recovery)
+        t = 0
+        while time is None or t < time:
+            infected_today = self._advance_day(recovery)
+            for intervention in interventions:
+                intervention.apply(self)
+            waiting = sum(len(b) for b in self.backlog)
+            snapshot = {
+                "day": t,
+                "step": self.total_time,
+                "num_infected": len(self.infecteds),
+                "backlog": waiting,
+                "states": self.counts.sum(axis=0)
+            }
+            if partitions:
+                snapshot["partitions"] = self.counts.copy()
+            if newly_infected:
+                snapshot["newly_infected"] = infected_today
+            yield snapshot
+            t += 1
+            if time is None and len(self.infecteds) == 0 and waiting == 0:
+                break
+        #endwhile
+
+    def simulate(self, time=100, printer=False, return_data=False, until=None, recovery='presampled', partition_curves=False, observers=None, interventions=None):
         """ 
             Runs the simulation on the network
             @params:
                 time[=100]: the amount of time that the simulation must be run
-                per_day_interaction_fraction[=0.5]: the fraction of people that will interact per day
+                printer[=False]: prints the number of infecteds every day
+                return_data[=False]: returns a list of (time, num_infected)
+                until[=None]: stops once there are more than this many infecteds
+                recovery[='presampled']: 'presampled' draws each infection's recovery day once,
+                        'hazard' redraws the recovery time of every infected each day (the old rule).
+                        Both give infectious periods with the same distribution.
+                partition_curves[=False]: records self.counts at the end of every day into a
+                        (days, partitions, states) array, kept in self.partition_curves and returned
+                        (after the data if return_data is also set)
+                observers[=None]: list of functions observer(model, stats) called at the end of every day
+                        with a dict of the day's counters:
+                            day, step (total_time), wall_time (seconds spent on the day),
+                            edges_examined (edges out of the infecteds), attempts (edges to a susceptible friend),
+                            infections, recoveries, num_infected, backlog (infected waiting for the weekend to end),
+                            rng_calls and random_draws (the number of variates drawn)
+                        the run stops at the end of the day if any observer returns True.
+                        See Observers for ready made ones.
+                interventions[=None]: list of Interventions.Intervention checked at the end of every day
+                        (before the observers, whose stats list the names of the ones that fired in "interventions").
+                        Their actions change the model in place and take effect from the next day.
+                        The days they fired on are kept on the model (see Intervention.fired), so a one-shot
+                        intervention fires once over a run split into several calls, and again on a fork taken before it fired.
         """
 
-
-        #N = len(self.individuals)
-        #num_interactions_per_day = per_day_interaction_fraction * N
-
         # range through all time
         to_return = [('time', 'num_infected')]
-        backlog = []
-
-        for t in xrange(time):
-            # generate a list of selected individuals
-
-            #selected_individuals = np.random.randint(N, size=num_interactions_per_day)
-            stored_infecteds = []
-            infecteds_count = Counter()
-            # loop through all individuals
-            # print self.infecteds
-            for i in self.infecteds:
-                
-                individual = self.individuals[i]
-                # if t == 0:
-                #     print individual.time_since_infected
-                # print('->checking individual:'+str(individual.id)+', #friends:'+str(len(individual.friends)))
-                for friendid, _ in individual.friends:
-                    unif = np.random.random() 
-                    if self.individuals[friendid].state == 0:
-                        if unif < self.transmission_rate: # person gets infected
-                            # print 'friend added=',friendid
-                            self.individuals[friendid].state = 1
-                            self.individuals[friendid].time_since_infected = 0
-                            stored_infecteds.append(friendid)
-                            infecteds_count.update(self.individuals[friendid].properties)
-                            #endif
-                    #endfor
-                if individual.time_since_infected > np.random.poisson(self.recovery_time)+np.random.randint(5):
-                    individual.state = 2
-                    self.infecteds.remove(individual.id)
-                else:
-                    individual.time_since_infected += 1
-                
-            # print 't=',self.total_time
-            self.total_time += 1
-            if self.total_time % 6 == 0 or self.total_time % 5 == 0:
-                backlog.extend(stored_infecteds)
+        observers = observers or []
+        interventions = interventions or []
+        Model._check_interventions(interventions)
+        stopped = False
+
+        self._schedule_pending(recovery)
+        curves = np.zeros((time,) + self.counts.shape, dtype=np.int64) if partition_curves else None
+
+        for t in range(time):
+            if observers:
+                start = timer()
+                stats = { "edges_examined":0, "attempts":0, "infections":0, "recoveries":0, "rng_calls":0, "random_draws":0 }
             else:
-                if len(backlog) > 0:
-                    # print 'extended:',backlog
-                    self.infecteds.extend(backlog)
-                    backlog = []
-                self.infecteds.extend(stored_infecteds)
-            #endfor
+                stats = None
+            self._advance_day(recovery, stats)
+            fired = [ intervention.name for intervention in interventions if intervention.apply(self) ]
             if return_data:
                 to_return.append((t, len(self.infecteds)))
+            if partition_curves:
+                curves[t] = self.counts
             if printer:
                 print(str(t)+','+str(len(self.infecteds)))
-            else:
-                # print('t='+str(t)+', # infected individuals='+str(len(self.infecteds)))
-                pass
-            if until and len(self.infecteds) > until:
-                print until
-                print('Reached '+str(len(self.infecteds))+' infected individuals at t='+str(t))
+            if observers:
+                stats.update(day=t, step=self.total_time, wall_time=timer() - start,
+                    num_infected=len(self.infecteds), backlog=sum(len(b) for b in self.backlog), interventions=fired)
+                for observer in observers:
+                    # every observer sees the last day, even if an earlier one stops the run
+                    stopped = observer(self, stats) or stopped
+            #endif
+            if stopped or (until and len(self.infecteds) > until):
                 break
         #end dayloop
 
+        if partition_curves:
+            self.partition_curves = curves[:t+1] if time else curves
+            return (to_return, self.partition_curves) if return_data else self.partition_curves
         if return_data:
             return to_return
 
+    def simulate_replicates(self, num_replicates, time=100, until=None, introductions=None, recovery='presampled'):
+        """
+            Runs several replicates of the simulation at once over this model's network.
+            All replicates share the graph and are stepped together with a
+            (num_replicates, num_individuals) state matrix, so every day is a single
+            vectorized draw. The model itself is left untouched.
+            @params:
+                num_replicates: the number of replicates to run
+                time[=100]: the amount of time that the simulation must be run
+                until[=None]: a replicate stops once it has more than this many infecteds
+                introductions[=None]: if given, the number of random infections each
+                        replicate adds on top of the model's current infecteds
+                recovery[='presampled']: 'presampled' or 'hazard', see simulate
+            returns a dict with:
+                time: the days of the curves
+                curves: the (num_replicates, time) array of the number of infecteds.
+                        A replicate that died out stays at 0, one that reached until is NaN afterwards.
+                state: the (num_replicates, num_individuals) matrix of final states
+        """
+        N = self.graph.num_individuals
+        R = num_replicates
+
+        # states of replicate r live at [r*N:(r+1)*N] of the flattened matrices
+        state = np.repeat(self.state[None,:], R, axis=0)
+        time_since_infected = np.repeat(self.time_since_infected.astype(np.int16)[None,:], R, axis=0)
+        state_flat = state.reshape(-1)
+        time_since_infected_flat = time_since_infected.reshape(-1)
+        infecteds = (np.arange(R, dtype=np.int64)[:,None]*N + self.infecteds[None,:]).ravel()
+
+        def draw_due(individuals, next_step):
+            # the step each infected recovers on, drawn once like schedule_recoveries
+            tsi = time_since_infected_flat[individuals]
+            return next_step + np.maximum(self.draw_recovery_ages(tsi) - tsi, 0)
+
+        # due[k] is the recovery step of infecteds[k]
+        due = draw_due(infecteds, self.total_time + 1)
+
+        if introductions:
+            introduced = np.arange(R, dtype=np.int64)[:,None]*N + self.rng.integers(N, size=(R, introductions))
+            introduced = np.unique(introduced)
+            introduced = introduced[state_flat[introduced] == 0]
+            state_flat[introduced] = self.states[1]
+            time_since_infected_flat[introduced] = 0
+            infecteds = np.concatenate((infecteds, introduced))
+            due = np.concatenate((due, draw_due(introduced, self.total_time + 1)))
+
+        curves = np.full((R, time), np.nan)
+        active = np.ones(R, dtype=bool)
+        # every replicate starts with the model's weekend backlog, infectious once it is released
+        waiting = np.concatenate([np.zeros(0, dtype=np.int64)] + self.backlog)
+        waiting = (np.arange(R, dtype=np.int64)[:,None]*N + waiting[None,:]).ravel()
+        backlog = [(waiting, draw_due(waiting, Model.release_step(self.total_time + 1) + 1))] if len(waiting) else []
+
+        for t in range(time):
+            replicates = infecteds // N
+            individuals = infecteds - replicates*N
+
+            # gather the friends of every infected of every replicate at once
+            positions, owners = self.active_edges(individuals)
+            friends = replicates[owners]*N + self.graph.indices[positions]
+            friends = friends[state_flat[friends] == 0]
+            newly_infected = np.unique(friends[self.rng.random(len(friends)) < self.transmission_rate])
+            state_flat[newly_infected] = 1
+            time_since_infected_flat[newly_infected] = 0
+
+            total_time = self.total_time + t + 1
+            if recovery == 'hazard':
+                recovered = time_since_infected_flat[infecteds] > self.draw_recovery_times(len(infecteds))
+                newly_due = np.zeros(len(newly_infected), dtype=np.int64)
+            else:
+                recovered = due <= total_time
+                newly_due = draw_due(newly_infected, Model.release_step(total_time) + 1)
+            state_flat[infecteds[recovered]] = 2
+            infecteds, due = infecteds[~recovered], due[~recovered]
+            time_since_infected_flat[infecteds] += 1
+
+            if Model.is_weekend(total_time):
+                backlog.append((newly_infected, newly_due))
+            else:
+                infecteds = np.concatenate([infecteds] + [ b for b, _ in backlog ] + [newly_infected])
+                due = np.concatenate([due] + [ d for _, d in backlog ] + [newly_due])
+                backlog = []
+            #endif
+
+            num_infected = np.bincount(infecteds // N, minlength=R)
+            curves[active, t] = num_infected[active]
 
-    def delete_random_edges(self, num_edges):
-        
-        deleted_edges = 0
-        for individual in self.individuals:
+            # replicates that died out or reached until drop out of the active set
+            pending = np.bincount(np.concatenate([ b for b, _ in backlog ]) // N, minlength=R) if backlog else np.zeros(R, dtype=np.int64)
+            died_out = active & (num_infected == 0) & (pending == 0)
+            curves[died_out, t+1:] = 0
+            finished = died_out | (active & (num_infected > until)) if until else died_out
+            if finished.any():
+                active &= ~finished
+                kept = active[infecteds // N]
+                infecteds, due = infecteds[kept], due[kept]
+                backlog = [ (b[active[b // N]], d[active[b // N]]) for b, d in backlog ]
+            if not active.any():
+                break
+        #end dayloop
 
-            k = len(individual.friends)
-            to_delete_proposed = np.random.poisson(num_edges)
-            to_delete = to_delete_proposed if to_delete_proposed < k else k
+        return {"time": np.arange(time), "curves": curves, "state": state}
 
-            to_delete = random.sample(individual.friends, to_delete)
-            for rem in to_delete:
-                deleted_edges+=1
-                self.individuals[rem[0]].friends.remove((individual.id,1))
-                individual.friends.remove(rem)
 
-        print('Deleted: '+str(deleted_edges)+' edges')
-    def delete_preferential_edges(self, num_edges):
+    def delete_edges(self, num_edges, predicate=None):
+        """
+            Deletes edges in bulk. Every individual gets a quota of k ~ poisson(num_edges)
+            of their remaining edges, which are picked at random all at once. The picked
+            edges that pass the predicate are removed together with their reverse edge
+            with a single update of the removed edge overlay.
+            @params:
+                num_edges: the average number of edges proposed per individual,
+                        either a number or an array with one entry per individual
+                predicate[=None]: function(graph, sources, targets) that returns a boolean
+                        array of which proposed edges may be deleted, eg: cross_partition.
+                        By default every proposed edge is deleted.
+            returns a Counter of (source partition, target partition) to the number of deleted connections.
+        """
+        graph = self.graph
+        reverse = graph.reverse_edges()
+        if self.removed_edges is None:
+            removed = np.zeros(graph.num_edges, dtype=bool)
+            positions = np.arange(graph.num_edges)
+            sources = graph.edge_sources()
+        else:
+            removed = self.removed_edges.copy()
+            positions = np.flatnonzero(~removed)
+            sources = graph.edge_sources()[positions]
+        degree = np.bincount(sources, minlength=graph.num_individuals)
+
+        # quota of each individual, no larger than their number of remaining edges
+        quota = np.minimum(self.rng.poisson(num_edges, size=graph.num_individuals), degree)
+
+        # shuffle the remaining edges within each individual and keep the first quota of them.
+        # sources is already sorted, so the shuffled order keeps the same sources.
+        order = np.argsort(sources + self.rng.random(len(sources)), kind='stable')
+        group_start = np.concatenate(([0], np.cumsum(degree)[:-1]))
+        proposed = order[np.arange(len(sources)) < np.repeat(group_start + quota, degree)]
+        positions, sources = positions[proposed], sources[proposed]
+
+        if predicate is not None:
+            allowed = np.asarray(predicate(graph, sources, graph.indices[positions]), dtype=bool)
+            positions, sources = positions[allowed], sources[allowed]
+
+        # a connection picked from both ends is only deleted (and counted) once
+        mirrors = reverse[positions]
+        removed[positions] = True
+        first = (mirrors < 0) | (positions <= mirrors) | ~removed[np.maximum(mirrors, 0)]
+        positions, sources, mirrors = positions[first], sources[first], mirrors[first]
+        removed[mirrors[mirrors >= 0]] = True
+        self.removed_edges = removed
+
+        codes = graph.partition_codes
+        num_partitions = len(graph.partition_names)
+        pairs = np.bincount(codes[sources].astype(np.int64)*num_partitions + codes[graph.indices[positions]],
+            minlength=num_partitions*num_partitions)
+        return Counter({ (graph.partition_names[p // num_partitions], graph.partition_names[p % num_partitions]): int(c)
+            for p, c in enumerate(pairs) if c })
+
+    def isolate(self, individuals):
+        """
+            Removes every edge of the given individuals (in both directions) with a
+            single update of the removed edge overlay.
+            @params:
+                individuals: array of individual IDs
+            returns the number of connections removed.
+        """
+        graph = self.graph
+        removed = np.zeros(graph.num_edges, dtype=bool) if self.removed_edges is None else self.removed_edges.copy()
+        positions = graph.edge_positions(np.asarray(individuals, dtype=np.int64))
+        positions = positions[~removed[positions]]
+        mirrors = graph.reverse_edges()[positions]
+        removed[positions] = True
+        removed[mirrors[mirrors >= 0]] = True
+        self.removed_edges = removed
+        # a connection between two isolated individuals is counted once
+        return int(len(positions) - np.count_nonzero((mirrors >= 0) & np.isin(mirrors, positions)) // 2)
+
+    def delete_random_edges(self, num_edges, verbose=False):
+        """
+            Deletes a random num of edges, see delete_edges.
+            @params:
+                verbose[=False]: prints the number of deleted edges
+        """
+        deleted_edges = self.delete_edges(num_edges)
+        if verbose:
+            print('Deleted: '+str(sum(deleted_edges.values()))+' edges')
+        return deleted_edges
+
+    def delete_preferential_edges(self, num_edges, verbose=False):
         """
             Deletes a random num of edges for non-self classes.
+            @params:
+                verbose[=False]: prints the number of deleted edges
         """
-        deleted_edges = 0
-        for individual in self.individuals:
-            k = len(individual.friends)
-
-            to_delete = np.random.poisson(num_edges)
-            to_delete = to_delete if to_delete < k else k
-            to_delete = random.sample(individual.friends, to_delete)
-            for rem in to_delete:
-                if self.individuals[rem[0]].properties != individual.properties:
-                    deleted_edges+=1
-                    # only delete if we do not share properties.
-                    self.individuals[rem[0]].friends.remove((individual.id,1))
-                    individual.friends.remove(rem)
-        print('Deleted: '+str(deleted_edges)+' edges')
+        deleted_edges = self.delete_edges(num_edges, predicate=cross_partition)
+        if verbose:
+            print('Deleted: '+str(sum(deleted_edges.values()))+' edges')
+        return deleted_edges
+
+
+def _takes_argument(function):
+    """
+        returns True if function can be called with one positional argument
+    """
+    try:
+        inspect.signature(function).bind(None)
+        return True
+    except TypeError:
+        return False
+    except ValueError:
+        # no signature, eg: some builtins
+        return False
+
+
+def poisson_cdf(mean):
+    """
+        returns the cumulative distribution of poisson(mean) up to where it reaches 1
+    """
+    if mean <= 0:
+        return np.ones(1)
+    last = int(mean + 40*math.sqrt(mean) + 40)
+    k = np.arange(last + 1)
+    pmf = np.exp(k*math.log(mean) - mean - np.array([ math.lgamma(i + 1) for i in range(last + 1) ]))
+    return np.cumsum(pmf)
+
+
+@lru_cache(maxsize=32)
+def _recovery_survival(recovery_time):
+    """
+        returns survival[a]: the chance that an infected is still infected once its
+        time_since_infected is a+1 under the per-day rule, where it recovers on the first
+        day its time_since_infected is above a fresh poisson(recovery_time) + randint(5).
+        That is the product over d <= a of P(threshold >= d).
+    """
+    cdf = poisson_cdf(recovery_time)
+    d = np.arange(len(cdf) + 5)
+    # P(threshold < d) averaged over the randint(5) shift
+    below = np.mean([ np.where(d - 1 - u >= 0, cdf[np.clip(d - 1 - u, 0, len(cdf) - 1)], 0.0) for u in range(5) ], axis=0)
+    survival = np.cumprod(np.clip(1 - below, 0.0, 1.0))
+    survival.flags.writeable = False
+    return survival
+
+
+def recovery_ages(recovery_time, time_since_infected, uniforms):
+    """
+        Turns uniform draws into the time_since_infected each infected recovers at under the
+        per-day rule, given that they are still infected at their current time_since_infected.
+        @params:
+            recovery_time: the recovery time of the model
+            time_since_infected: array of the current time_since_infected of the infecteds
+            uniforms: one uniform draw in [0, 1) per infected
+    """
+    survival = _recovery_survival(float(recovery_time))
+    time_since_infected = np.asarray(time_since_infected, dtype=np.int64)
+    # survival[a-1] is the chance of still being infected at a
+    reached = np.concatenate(([1.0], survival))[np.minimum(time_since_infected, len(survival))]
+    return np.searchsorted(-survival, -uniforms*reached, side='left')
+
+
+def cross_partition(graph, sources, targets):
+    """
+        Edge predicate that only allows edges between different partitions.
+    """
+    return graph.partition_codes[sources] != graph.partition_codes[targets]
+
+
+def cross_property(index):
+    """
+        Creates an edge predicate that only allows edges whose ends differ in one
+        of the comma separated properties.
+        @params:
+            index: the position of the property, eg: 0 for the class of "SCI,1"
+    """
+    def predicate(graph, sources, targets):
+        values = [ name.split(',')[index] for name in graph.partition_names ]
+        lookup = np.unique(values, return_inverse=True)[1]
+        return lookup[graph.partition_codes[sources]] != lookup[graph.partition_codes[targets]]
+    return predicate
@@ -0,0 +1,75 @@
+import sys
+from timeit import default_timer as timer
+
+COUNTERS = ["wall_time", "edges_examined", "attempts", "infections", "recoveries", "rng_calls", "random_draws"]
+
+
+class Recorder(object):
+    def __init__(self):
+        """
+            Simulation observer that keeps the stats of every day.
+            eg: recorder = Recorder(); model.simulate(observers=[recorder]); recorder.totals()
+        """
+        self.days = []
+
+    def __call__(self, model, stats):
+        self.days.append(stats)
+
+    def column(self, key):
+        """
+            returns the list of the values of one of the stats for every recorded day
+        """
+        return [ day[key] for day in self.days ]
+
+    def totals(self):
+        """
+            returns a dict of the sum of every counter over the recorded days
+            and the success rate of the transmission attempts
+        """
+        totals = { key: sum(day[key] for day in self.days) for key in COUNTERS }
+        totals["days"] = len(self.days)
+        totals["success_rate"] = float(totals["infections"]) / totals["attempts"] if totals["attempts"] else 0.0
+        return totals
+
+
+def print_progress(file=None, every=1):
+    """
+        Creates an observer that prints day,num_infected,backlog,wall_time lines.
+        @params:
+            file[=None]: where to print (=sys.stdout)
+            every[=1]: only prints every this many days
+    """
+    def observer(model, stats):
+        if stats["day"] % every == 0:
+            (file or sys.stdout).write('%d,%d,%d,%.6f\n' % (stats["day"], stats["num_infected"], stats["backlog"], stats["wall_time"]))
+    return observer
+
+
+def stop_above(num_infected):
+    """
+        Creates an observer that stops the run once there are more than num_infected infecteds,
+        like simulate(until=num_infected).
+    """
+    def observer(model, stats):
+        return stats["num_infected"] > num_infected
+    return observer
+
+
+def stop_when_extinct(model, stats):
+    """
+        Observer that stops the run once nobody is infected or waiting in the backlog.
+    """
+    return stats["num_infected"] == 0 and stats["backlog"] == 0
+
+
+def stop_after(seconds):
+    """
+        Creates an observer that stops the run at the end of the first day after
+        seconds of wall time have passed since its first call.
+    """
+    started = []
+    def observer(model, stats):
+        if not started:
+            started.append(timer() - stats["wall_time"])
+        return timer() - started[0] > seconds
+    return observer
@@ -0,0 +1,365 @@
+import numpy as np
+import multiprocessing
+import multiprocessing.connection
+from multiprocessing import shared_memory
+from Model import Model, recovery_ages
+
+# streams of the counter based random numbers
+ATTEMPTS, RECOVERY = 1, 2
+
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+
+# the shared arrays the workers write, copied back into the model
+RESULTS = ["state", "time_since_infected", "recovery_day", "marks", "curve"]
+
+
+def _mix(z):
+    """
+        splitmix64 finalizer of a uint64 array
+    """
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+
+def uniforms(key, stream, step, counters):
+    """
+        Counter based uniform draws in [0, 1). The same (key, stream, step, counter) always
+        gives the same number, so each shard can draw the numbers of its own edges and
+        individuals without sharing a random stream, and the results do not depend on
+        how the network is sharded.
+        @params:
+            key: the seed of the run
+            stream: which kind of draw, eg: ATTEMPTS
+            step: the step the numbers are drawn on
+            counters: array of edge positions or individual IDs
+    """
+    base = np.zeros(1, dtype=np.uint64)
+    for value in (key, stream, step):
+        base = _mix(base + np.array([value], dtype=np.uint64) * _GOLDEN)
+    z = _mix(np.asarray(counters).astype(np.uint64) * _GOLDEN + base)
+    return (z >> np.uint64(11)).astype(np.float64) * (1.0 / 2**53)
+
+
+def _recovery_ages(params, time_since_infected, individuals, step):
+    """
+        The counter based version of Model.draw_recovery_ages for individuals infected on step.
+    """
+    return recovery_ages(params["recovery_time"], time_since_infected,
+        uniforms(params["key"], RECOVERY, step, individuals))
+
+
+class _Shard(object):
+    def __init__(self, arrays, params, shard, barrier):
+        """
+            The part of the network (and its infecteds) that one worker simulates.
+            Workers only write the state of their own individuals, infection attempts
+            on other shards are handed over through the shared marks array.
+        """
+        self.arrays = arrays
+        self.params = params
+        self.barrier = barrier
+        self.owned = np.flatnonzero(arrays["shard_of"] == shard)
+        # shards of consecutive IDs scan their marks as a slice
+        if len(self.owned) and self.owned[-1] - self.owned[0] + 1 == len(self.owned):
+            self.owned = slice(int(self.owned[0]), int(self.owned[-1]) + 1)
+        self.shard = shard
+        self.total_time = params["total_time"]
+        self.calendar = {}
+
+    def wait(self):
+        if self.barrier is not None:
+            self.barrier.wait()
+
+    def owned_ids(self, selected):
+        if isinstance(self.owned, slice):
+            return np.flatnonzero(selected) + self.owned.start
+        return self.owned[selected]
+
+    def schedule_recoveries(self, individuals, next_step, step):
+        """
+            Model.schedule_recoveries with the counter based recovery ages drawn for step.
+        """
+        if len(individuals) == 0:
+            return
+        tsi = self.arrays["time_since_infected"][individuals]
+        days = next_step + np.maximum(_recovery_ages(self.params, tsi, individuals, step) - tsi, 0)
+        self.arrays["recovery_day"][individuals] = days
+        Model._file_calendar(self.calendar, individuals, days)
+
+    def start(self):
+        """
+            Takes over the infecteds (marked 1) and backlog (marked 2) of the shard from
+            the parent and files the pending recoveries of its infected individuals.
+        """
+        marks, state, recovery_day = self.arrays["marks"], self.arrays["state"], self.arrays["recovery_day"]
+        marked = marks[self.owned]
+        self.infecteds = self.owned_ids(marked == 1)
+        waiting = self.owned_ids(marked == 2)
+        self.backlog = [waiting] if len(waiting) else []
+        marks[self.infecteds] = 0
+        marks[waiting] = 0
+
+        infected = self.owned_ids(state[self.owned] == 1)
+        pending = infected[recovery_day[infected] > self.total_time]
+        Model._file_calendar(self.calendar, pending, recovery_day[pending])
+        # infecteds without a pending recovery get one now, like in Model.simulate
+        unscheduled = self.infecteds[recovery_day[self.infecteds] <= self.total_time]
+        self.schedule_recoveries(unscheduled, self.total_time + 1, self.total_time)
+        unscheduled = waiting[recovery_day[waiting] <= self.total_time]
+        self.schedule_recoveries(unscheduled, Model.release_step(self.total_time + 1) + 1, self.total_time)
+
+    def attempt(self, step):
+        """
+            Tries every edge out of the shard's infecteds to a susceptible friend
+            and marks the friends that were reached.
+        """
+        indptr, indices, removed = self.arrays["indptr"], self.arrays["indices"], self.arrays.get("removed_edges")
+        starts = indptr[self.infecteds]
+        counts = indptr[self.infecteds + 1] - starts
+        positions = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum(), dtype=np.int64)
+        if removed is not None:
+            positions = positions[~removed[positions]]
+        # the states of other shards are only written after the barrier
+        positions = positions[self.arrays["state"][indices[positions]] == 0]
+        reached = positions[uniforms(self.params["key"], ATTEMPTS, step, positions) < self.params["transmission_rate"]]
+        self.arrays["marks"][indices[reached]] = 1
+
+    def infect(self, step):
+        """
+            Infects the shard's marked individuals, recovers the ones due and releases
+            the new infecteds like Model._transmission_step and Model.simulate.
+            returns the array of newly infected IDs.
+        """
+        marks, state, time_since_infected = self.arrays["marks"], self.arrays["state"], self.arrays["time_since_infected"]
+        frontier = self.infecteds
+        candidates = self.owned_ids(marks[self.owned] == 1)
+        marks[candidates] = 0
+        newly_infected = candidates[state[candidates] == 0]
+        state[newly_infected] = 1
+        time_since_infected[newly_infected] = 0
+
+        due = self.calendar.pop(step, [])
+        due = np.concatenate(due) if due else np.zeros(0, dtype=np.int64)
+        due = due[(state[due] == 1) & (self.arrays["recovery_day"][due] == step)]
+        if len(due):
+            state[due] = 2
+            self.infecteds = frontier[state[frontier] == 1]
+        self.schedule_recoveries(newly_infected, Model.release_step(step) + 1, step)
+        time_since_infected[self.infecteds] += 1
+        return newly_infected
+
+    def run(self, time, until):
+        """
+            Runs the days in lock-step with the other shards.
+            returns the number of days run.
+        """
+        curve = self.arrays["curve"]
+        self.start()
+        self.wait()
+        for t in range(time):
+            step = self.total_time + 1
+            self.attempt(step)
+            self.wait()
+            stored_infecteds = self.infect(step)
+
+            self.total_time += 1
+            # people infected on the weekend only become infectious on the next weekday
+            if Model.is_weekend(self.total_time):
+                self.backlog.append(stored_infecteds)
+            else:
+                self.infecteds = np.concatenate([self.infecteds] + self.backlog + [stored_infecteds])
+                self.backlog = []
+            #endif
+            curve[self.shard, t] = len(self.infecteds)
+            self.wait()
+            # every shard sees the same total and stops on the same day
+            if until and curve[:, t].sum() > until:
+                t += 1
+                break
+        else:
+            t = time
+        #end dayloop
+
+        self.arrays["marks"][self.infecteds] = 1
+        for waiting in self.backlog:
+            self.arrays["marks"][waiting] = 2
+        return t
+
+
+def _attach(names, layouts):
+    """
+        Maps the parent's shared memory blocks in a worker process.
+    """
+    blocks, arrays = [], {}
+    for key, name in names.items():
+        # workers share the parent's resource tracker, the parent unlinks the blocks
+        block = shared_memory.SharedMemory(name=name)
+        dtype, shape = layouts[key]
+        arrays[key] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        blocks.append(block)
+    return blocks, arrays
+
+
+def _shard_process(names, layouts, params, shard, barrier, time, until, days):
+    blocks, arrays = _attach(names, layouts)
+    try:
+        ran = _Shard(arrays, params, shard, barrier).run(time, until)
+        if shard == 0:
+            days.value = ran
+    except BaseException:
+        barrier.abort()
+        raise
+    finally:
+        del arrays
+        for block in blocks:
+            block.close()
+
+
+def shard_assignment(model, shards='range', num_shards=None):
+    """
+        returns the shard of every individual.
+        @params:
+            model: the Model to shard
+            shards[='range']: 'range' splits the IDs into num_shards blocks of consecutive IDs,
+                    'partition' keeps the individuals of each of model.partitioning together
+                    (largest partitions first, onto the shard with the fewest individuals),
+                    or an array with the shard of every individual, eg: from a graph partitioner.
+            num_shards[=None]: the number of shards (=os.cpu_count())
+    """
+    N = model.graph.num_individuals
+    num_shards = num_shards or multiprocessing.cpu_count()
+    if not isinstance(shards, str):
+        shard_of = np.asarray(shards, dtype=np.int32)
+        assert len(shard_of) == N, 'There must be a shard for every individual.'
+        return shard_of
+    if shards == 'range':
+        return (np.arange(N, dtype=np.int64) * num_shards // max(N, 1)).astype(np.int32)
+    if shards == 'partition':
+        sizes = np.bincount(model.graph.partition_codes, minlength=len(model.graph.partition_names))
+        num_shards = min(num_shards, len(sizes))
+        loads = np.zeros(num_shards, dtype=np.int64)
+        shard_of_partition = np.zeros(len(sizes), dtype=np.int32)
+        for code in np.argsort(-sizes, kind='stable'):
+            shard_of_partition[code] = loads.argmin()
+            loads[loads.argmin()] += sizes[code]
+        return shard_of_partition[model.graph.partition_codes]
+    raise ValueError('Unknown sharding '+repr(shards))
+
+
+def simulate_sharded(model, time=100, until=None, shards='range', processes=None, seed=None):
+    """
+        Runs Model.simulate (with presampled recoveries) split over worker processes.
+        The network is divided into shards, one per worker. The network and the state of
+        every individual live in shared memory and the workers step the days in lock-step:
+        each one tries the edges of its own infecteds, marks the friends it reached,
+        and after a barrier infects and recovers its own individuals.
+        Random numbers are drawn from a counter based stream keyed by the edge or individual
+        and the step, so the run gives the same result for any number of shards or processes.
+        @params:
+            model: the Model to run, its state is updated like Model.simulate does
+            time[=100]: the number of days to simulate
+            until[=None]: stops once there are more than this many infecteds
+            shards[='range']: how to shard the network, see shard_assignment
+            processes[=None]: the number of worker processes (=os.cpu_count()), 1 runs in this process
+            seed[=None]: seed of the counter based stream. By default it is drawn from model.rng,
+                    so forks with the same seed give the same run.
+        returns the same [('time', 'num_infected'), (t, num_infected), ...] data as simulate(return_data=True)
+        (!) the numbers are not the ones model.rng would give, the runs of simulate and
+            simulate_sharded agree in distribution but not draw for draw.
+    """
+    graph = model.graph
+    N = graph.num_individuals
+    if processes == 1:
+        shard_of = np.zeros(N, dtype=np.int32)
+    else:
+        shard_of = shard_assignment(model, shards, processes)
+    num_shards = int(shard_of.max()) + 1 if N else 1
+    params = {
+        "key": int(model.rng.integers(2**63)) if seed is None else int(seed),
+        "transmission_rate": model.transmission_rate,
+        "recovery_time": model.recovery_time,
+        "total_time": model.total_time
+    }
+
+    sources = {
+        "indptr": graph.indptr,
+        "indices": graph.indices,
+        "shard_of": shard_of,
+        "state": model.state,
+        "time_since_infected": model.time_since_infected,
+        "recovery_day": model.recovery_day,
+        "marks": np.zeros(N, dtype=np.uint8),
+        "curve": np.zeros((num_shards, time), dtype=np.int64)
+    }
+    if model.removed_edges is not None:
+        sources["removed_edges"] = model.removed_edges
+    sources["marks"][model.infecteds] = 1
+    for waiting in model.backlog:
+        sources["marks"][waiting] = 2
+
+    if num_shards == 1:
+        arrays = dict(sources)
+        for key in RESULTS:
+            arrays[key] = arrays[key].copy()
+        days = _Shard(arrays, params, 0, None).run(time, until)
+    else:
+        blocks = {}
+        try:
+            arrays = {}
+            for key, array in sources.items():
+                blocks[key] = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                arrays[key] = np.ndarray(array.shape, dtype=array.dtype, buffer=blocks[key].buf)
+                arrays[key][...] = array
+            days = _run_processes(blocks, arrays, params, num_shards, time, until)
+            arrays = { key: arrays[key].copy() for key in RESULTS }
+        finally:
+            for block in blocks.values():
+                block.close()
+                block.unlink()
+
+    # write the state at the end of the last day back to the model
+    model.state = arrays["state"]
+    model.time_since_infected = arrays["time_since_infected"]
+    model.recovery_day = arrays["recovery_day"]
+    model.infecteds = np.flatnonzero(arrays["marks"] == 1)
+    waiting = np.flatnonzero(arrays["marks"] == 2)
+    model.backlog = [waiting] if len(waiting) else []
+    model.total_time += days
+    model.rebuild_recovery_calendar()
+    model.recount()
+
+    curve = arrays["curve"].sum(axis=0)
+    return [('time', 'num_infected')] + [ (t, int(curve[t])) for t in range(days) ]
+
+
+def _run_processes(blocks, arrays, params, num_shards, time, until):
+    """
+        Runs one worker process per shard and waits for all of them.
+        returns the number of days run.
+    """
+    names = { key: block.name for key, block in blocks.items() }
+    layouts = { key: (array.dtype.str, array.shape) for key, array in arrays.items() }
+    barrier = multiprocessing.Barrier(num_shards)
+    days = multiprocessing.Value('q', 0)
+    workers = [ multiprocessing.Process(target=_shard_process,
+        args=(names, layouts, params, shard, barrier, time, until, days)) for shard in range(num_shards) ]
+    for worker in workers:
+        worker.start()
+    try:
+        running = list(workers)
+        while running:
+            for sentinel in multiprocessing.connection.wait([ w.sentinel for w in running ]):
+                worker = [ w for w in running if w.sentinel == sentinel ][0]
+                worker.join()
+                running.remove(worker)
+                if worker.exitcode != 0:
+                    # release the workers waiting on the failed one
+                    barrier.abort()
+                    raise RuntimeError('Shard worker failed with exit code '+str(worker.exitcode))
+    finally:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+            worker.join()
+    return days.value
@@ -0,0 +1,109 @@
+import numpy as np
+import asyncio
+import json
+
+QUEUE_SIZE = 64 # days kept for a slow client before it starts missing some
+
+
+def snapshot_json(snapshot):
+    """
+        returns a snapshot of Model.steps as a JSON string
+    """
+    return json.dumps({ key: value.tolist() if isinstance(value, np.ndarray) else value
+        for key, value in snapshot.items() })
+
+
+async def asteps(model, time=None, interval=0, executor=None, **kwargs):
+    """
+        The asyncio version of Model.steps. Every day is computed in an executor thread,
+        so the event loop keeps serving (eg: a web server) while the model runs.
+        eg: async for snapshot in asteps(model, time=100): await websocket.send(snapshot_json(snapshot))
+        @params:
+            model: the Model to run
+            time[=None]: the number of days, see Model.steps
+            interval[=0]: seconds to wait between days, eg: to pace a live view
+            executor[=None]: the concurrent.futures executor to run the days in (=the loop's default)
+            **kwargs: passed on to Model.steps
+    """
+    loop = asyncio.get_running_loop()
+    steps = model.steps(time=time, **kwargs)
+    done = object()
+    try:
+        while True:
+            # only one day is ever in flight, so the generator never runs in two threads at once
+            snapshot = await loop.run_in_executor(executor, next, steps, done)
+            if snapshot is done:
+                break
+            yield snapshot
+            if interval:
+                await asyncio.sleep(interval)
+        #endwhile
+    finally:
+        steps.close()
+
+
+async def serve(model, host='127.0.0.1', port=8000, wait=True, interval=0, **kwargs):
+    """
+        Runs the model and streams every day to the browsers connected to a local
+        server as Server-Sent Events, eg: new EventSource("http://127.0.0.1:8000/") in Graph2.html.
+        Each event is the snapshot_json of a day. The run is shared by every client and
+        a client that falls QUEUE_SIZE days behind misses days instead of using more memory.
+        eg: asyncio.run(serve(model, time=100, interval=0.5, partitions=True))
+        @params:
+            model: the Model to run
+            host[='127.0.0.1']: the address to listen on
+            port[=8000]: the port to listen on
+            wait[=True]: waits for the first client to connect before the run starts
+            interval[=0]: seconds to wait between days
+            **kwargs: passed on to Model.steps
+    """
+    clients = set()
+    connected = asyncio.Event()
+
+    async def handle(reader, writer):
+        try:
+            await reader.readuntil(b'\r\n\r\n')
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            writer.close()
+            return
+        writer.write(b'HTTP/1.1 200 OK\r\n'
+            b'Content-Type: text/event-stream\r\n'
+            b'Cache-Control: no-cache\r\n'
+            b'Access-Control-Allow-Origin: *\r\n'
+            b'Connection: keep-alive\r\n\r\n')
+        queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        clients.add(queue)
+        connected.set()
+        try:
+            while True:
+                message = await queue.get()
+                if message is None:
+                    break
+                writer.write(message)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            clients.discard(queue)
+            writer.close()
+
+    def broadcast(message):
+        for queue in list(clients):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(message)
+
+    server = await asyncio.start_server(handle, host, port)
+    try:
+        if wait:
+            await connected.wait()
+        async for snapshot in asteps(model, interval=interval, **kwargs):
+            broadcast(('data: ' + snapshot_json(snapshot) + '\n\n').encode())
+        broadcast(b'event: end\ndata: {}\n\n')
+        broadcast(None)
+        # let the clients receive the end of the run
+        while clients:
+            await asyncio.sleep(0.01)
+    finally:
+        server.close()
+        await server.wait_closed()
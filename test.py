@@ -1,4 +1,5 @@
-from Model import Model
+from Model import Model, cross_partition
+from Interventions import Intervention, prevalence_above, delete_edges
 import numpy as np
 import json
 import matplotlib.pyplot as plt
@@ -8,10 +9,10 @@ from collections import Counter
 
 
 model = Model.create_realistic_network(2000, 
-              {"SCI,1":lambda:np.random.poisson(5), 
-              "SCI,2":lambda: np.random.poisson(5), 
-              "HUM,1":lambda:np.random.poisson(6), 
-              "HUM,2":lambda:np.random.poisson(6)}, 
+              {"SCI,1":lambda rng: rng.poisson(5), 
+              "SCI,2":lambda rng: rng.poisson(5), 
+              "HUM,1":lambda rng: rng.poisson(6), 
+              "HUM,2":lambda rng: rng.poisson(6)}, 
               {"SCI,1":0.30, "SCI,2":0.2, "HUM,1":0.30, "HUM,2":0.2}, 
               {# within class
                ("SCI,1","SCI,1"):0.5,
@@ -32,20 +33,16 @@ model = Model.create_realistic_network(2000,
 
 # reaction_model = model.deep_copy()
 model.introduce_infection()
-reaction_model2 = model.deep_copy()
-reaction_model3 = model.deep_copy()
+reaction_model2 = model.fork()
+reaction_model3 = model.fork()
 
 until = 200
-non_delete_data = model.simulate(time=100, return_data=True)[1:]
-delete_data = reaction_model2.simulate(until=until, time=100, return_data=True)[1:]
-delete_data2 = reaction_model3.simulate(until=until,time=100, return_data=True)[1:]
-
-reaction_model2.delete_preferential_edges(2)
-reaction_model3.delete_random_edges(2)
-
-delete_data.extend(reaction_model2.simulate(time=100, return_data=True)[1:])
-non_delete_data.extend(model.simulate(time=100,return_data=True)[1:])
-delete_data2.extend(reaction_model3.simulate(time=100,return_data=True)[1:])
+# the campus announcement deletes edges once there are more than until infecteds
+non_delete_data = model.simulate(time=200, return_data=True)[1:]
+delete_data = reaction_model2.simulate(time=200, return_data=True,
+	interventions=[Intervention(prevalence_above(until), delete_edges(2, cross_partition), name='preferential delete')])[1:]
+delete_data2 = reaction_model3.simulate(time=200, return_data=True,
+	interventions=[Intervention(prevalence_above(until), delete_edges(2), name='random delete')])[1:]
 
 delete_data = np.array(delete_data)
 non_delete_data = np.array(non_delete_data)